@@ -0,0 +1,160 @@
+from typing import Dict, List, Optional
+import asyncio
+import heapq
+import itertools
+import os
+import time
+
+# Admission control in front of each backend. A backend runs at most
+# `concurrency` calls at once; further calls wait in a bounded queue ordered by
+# priority class, then arrival:
+#   finalize     LLM3 finishing a session that is already 12 turns in (and
+#                regenerating a stored prompt)
+#   turn         the next interview reply of an in-flight session
+#   greeting     the opening message of a brand-new session
+#   batch        pre-filled /batch records
+#   speculative  background drafts and cache warming (see speculation.py)
+# A call is shed rather than served late: when the queue is full (the newcomer
+# displaces the lowest-priority waiter if it outranks it) or when it has waited
+# past its class deadline. Shed calls raise Overloaded with a Retry-After
+# estimate, which the API turns into 429 (or 503 when every provider is down)
+# instead of piling up work the client has already given up on.
+
+PRIORITIES = ("finalize", "turn", "greeting", "batch", "speculative")
+
+def _deadlines(spec: str) -> Dict[str, float]:
+    # "finalize:60,turn:20,..." -> seconds a call may wait in the queue
+    deadlines = {}
+    for item in spec.split(","):
+        if item.strip():
+            name, seconds = item.split(":")
+            deadlines[name.strip()] = float(seconds)
+    return deadlines
+
+DEADLINES: Dict[str, float] = _deadlines(
+    os.getenv("ADMISSION_DEADLINES", "finalize:60,turn:20,greeting:10,batch:120,speculative:5")
+)
+MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "64")) # waiting calls per backend
+
+def priority_for(stage: str) -> str:
+    # Priority class of a model call from its telemetry stage label
+    if stage.startswith("speculative"):
+        return "speculative"
+    if stage.startswith("batch"):
+        return "batch"
+    if stage.startswith("finalize") or stage == "regenerate":
+        return "finalize"
+    if stage == "greeting":
+        return "greeting"
+    return "turn"
+
+
+class Overloaded(Exception):
+    # The call was shed by admission control; retry after `retry_after` seconds
+    def __init__(self, backend: str, priority: str, reason: str, retry_after: float):
+        super().__init__(f"{backend} is overloaded ({reason}, {priority} call)")
+        self.backend = backend
+        self.priority = priority
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ("rank", "seq", "priority", "future", "enqueued")
+
+    def __init__(self, rank: int, seq: int, priority: str, future: asyncio.Future):
+        self.rank = rank
+        self.seq = seq
+        self.priority = priority
+        self.future = future
+        self.enqueued = time.monotonic()
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.rank, self.seq) < (other.rank, other.seq)
+
+
+class AdmissionGate:
+    def __init__(self, name: str, concurrency: int, max_queue: int = MAX_QUEUE,
+                 deadlines: Optional[Dict[str, float]] = None):
+        self.name = name
+        self.concurrency = max(concurrency, 1)
+        self.max_queue = max_queue
+        self.deadlines = DEADLINES if deadlines is None else deadlines
+        self.in_flight = 0
+        self._waiters: List[_Waiter] = [] # heap
+        self._seq = itertools.count()
+        self._service_seconds = 1.0 # moving average of a call's duration
+        self.shed: Dict[tuple, int] = {} # (priority, reason) -> count
+
+    def depth(self) -> Dict[str, int]:
+        counts = dict.fromkeys(PRIORITIES, 0)
+        for waiter in self._waiters:
+            if not waiter.future.done():
+                counts[waiter.priority] += 1
+        return counts
+
+    def retry_after(self) -> float:
+        # Time to drain the current queue at the current pace, at least 1s
+        queued = sum(1 for waiter in self._waiters if not waiter.future.done())
+        return max(1.0, (queued + 1) * self._service_seconds / self.concurrency)
+
+    def _reject(self, priority: str, reason: str) -> Overloaded:
+        self.shed[(priority, reason)] = self.shed.get((priority, reason), 0) + 1
+        return Overloaded(self.name, priority, reason, self.retry_after())
+
+    def _admit_waiting(self) -> None:
+        # Hand free slots to the best waiters
+        while self._waiters and self.in_flight < self.concurrency:
+            waiter = heapq.heappop(self._waiters)
+            if not waiter.future.done():
+                self.in_flight += 1
+                waiter.future.set_result(None)
+
+    async def acquire(self, priority: str, deadline: Optional[float] = None) -> None:
+        # `deadline` is an absolute time.monotonic() by which the slot must be
+        # granted; by default the priority class deadline from now
+        while self._waiters and self._waiters[0].future.done():
+            heapq.heappop(self._waiters) # shed or abandoned
+        if self.in_flight < self.concurrency and not self._waiters:
+            self.in_flight += 1
+            return
+        rank = PRIORITIES.index(priority)
+        live = [waiter for waiter in self._waiters if not waiter.future.done()]
+        if len(live) >= self.max_queue:
+            lowest = max(live)
+            if lowest.rank <= rank:
+                raise self._reject(priority, "queue_full")
+            # The newcomer outranks the lowest waiter, which is shed instead
+            lowest.future.set_exception(self._reject(lowest.priority, "displaced"))
+        if len(self._waiters) > 2 * self.max_queue:
+            self._waiters = [waiter for waiter in self._waiters if not waiter.future.done()]
+            heapq.heapify(self._waiters)
+
+        waiter = _Waiter(rank, next(self._seq), priority, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._waiters, waiter)
+        self._admit_waiting()
+        if deadline is None:
+            deadline = waiter.enqueued + self.deadlines.get(priority, 30)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), max(deadline - time.monotonic(), 0))
+        except asyncio.TimeoutError:
+            if self._granted(waiter):
+                return # granted just as the deadline passed
+            waiter.future.cancel()
+            raise self._reject(priority, "deadline")
+        except asyncio.CancelledError:
+            if self._granted(waiter):
+                self.release(0) # granted, but the caller went away
+            waiter.future.cancel()
+            raise
+
+    @staticmethod
+    def _granted(waiter: _Waiter) -> bool:
+        future = waiter.future
+        return future.done() and not future.cancelled() and future.exception() is None
+
+    def release(self, seconds: float) -> None:
+        self.in_flight -= 1
+        if seconds > 0:
+            self._service_seconds = 0.9 * self._service_seconds + 0.1 * seconds
+        self._admit_waiting()
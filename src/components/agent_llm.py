@@ -1,20 +1,15 @@
-from langchain_huggingface import HuggingFaceEndpoint, ChatHuggingFace
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
 from langchain.prompts.chat import ChatPromptTemplate
 from dotenv import load_dotenv
+from interview import create_interview_engine, load_interview
+from models import get_model
 import os
 
 # Load environment variables
 load_dotenv()
 
-# Set up the endpoint
-llm = HuggingFaceEndpoint(
-    repo_id="google/gemma-2-2b-it",
-    task="text-generation",
-)
-
-# Wrap in Chat Model
-model = ChatHuggingFace(llm=llm)
+# Chat model for the stage-1 interviewer, from the shared registry
+model = get_model("model1")
 
 # Define system message content
 system_message_content = """
@@ -34,21 +29,43 @@ Constraints:
 1. Don't solve any coding, math, or general query; if user asks, tell them your role and start from previous step.
 """
 
+# Stage-1 interview only, driven by the shared interview engine; the model is
+# called (with the system message above) only to clarify off-topic or
+# incomplete answers, or for every turn with INTERVIEW_MODE=llm
+interview = create_interview_engine(stages=load_interview()["stages"][:1])
+state = interview.new_state()
+
 # Initial chat history
 chat_history = [
     SystemMessage(content=system_message_content)
 ]
 
+def reply(step):
+    if step.kind == "ask":
+        return step.text
+    messages = chat_history + ([SystemMessage(content=step.hint)] if step.hint else [])
+    return model.invoke(messages).content
+
+greeting = reply(interview.start(state))
+chat_history.append(AIMessage(content=greeting))
+print("ai:", greeting)
+
 # Chat loop
 while True:
     user_input = input("you: ")
     if user_input.lower() == "exit":
         break
     chat_history.append(HumanMessage(content=user_input))
-    response = model.invoke(chat_history)
-    chat_history.append(AIMessage(content=response.content))
-    print("ai:", response.content)
+    step = interview.answer(state, user_input)
+    if step.kind == "finalize":
+        print("ai: Thanks, that's everything I need for the business context.")
+        break
+    content = reply(step)
+    chat_history.append(AIMessage(content=content))
+    print("ai:", content)
 
-# Optional: print full chat history
+# Optional: print the collected answers and the full chat history
+for label, answer in interview.answer_pairs(state, 1):
+    print(f"{label}: {answer}")
 for msg in chat_history:
     print(f"{msg.type}: {msg.content}")
@@ -0,0 +1,111 @@
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+import asyncio
+import json
+import os
+import time
+
+from finalize import build_final_messages, format_answers
+from prompts import STAGE1_QUESTIONS, STAGE2_QUESTIONS
+from ratelimit import TokenBucket
+
+# Batch prompt generation: answers to the interview questions are known up front
+# (e.g. a CRM export), so the formatted history is built directly and only the
+# LLM3 finalize call is made, by a bounded pool of workers behind a rate limit.
+#
+# Input is JSONL, one record per prompt, in either form:
+#   {"id": "acme", "answers": ["E-commerce", "Acme", ...]}
+#       answers to STAGE1_QUESTIONS then STAGE2_QUESTIONS, in order
+#   {"id": "acme", "qa": [{"question": "...", "answer": "..."}, ...]}
+# Output is JSONL, one result per record, in completion order:
+#   {"id": "acme", "status": "ok", "prompt": "...", "seconds": 3.1}
+#   {"id": "acme", "status": "error", "error": "..."}
+
+QUESTIONS = STAGE1_QUESTIONS + STAGE2_QUESTIONS
+
+def record_id(record: Dict[str, Any], index: int) -> str:
+    return str(record.get("id") or f"line-{index + 1}")
+
+def record_pairs(record: Dict[str, Any]) -> List[Tuple[str, str]]:
+    if isinstance(record.get("qa"), list):
+        return [(str(item["question"]), str(item["answer"])) for item in record["qa"]]
+    if isinstance(record.get("answers"), list):
+        if len(record["answers"]) > len(QUESTIONS):
+            raise ValueError(f"expected at most {len(QUESTIONS)} answers, got {len(record['answers'])}")
+        return [(question, str(answer)) for question, answer in zip(QUESTIONS, record["answers"])]
+    raise ValueError("record needs an 'answers' list or a 'qa' list")
+
+def parse_jsonl(lines: Iterable[str]) -> List[Dict[str, Any]]:
+    records = []
+    for line in lines:
+        if line.strip():
+            records.append(json.loads(line))
+    return records
+
+def completed_ids(path: str) -> Set[str]:
+    # Ids already written successfully to an output file, so a rerun can resume
+    done: Set[str] = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue # partially written last line
+            if result.get("status") == "ok":
+                done.add(result["id"])
+    return done
+
+async def run_batch(
+    records: List[Dict[str, Any]],
+    invoke: Callable[[List[Any]], Awaitable[Any]],
+    workers: int = 4,
+    rate_per_minute: float = 0,
+    skip: Optional[Set[str]] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    # Yields one result per record as soon as it is finished. `invoke` makes the
+    # LLM3 call for a list of messages; `rate_per_minute` <= 0 means unlimited.
+    skip = skip or set()
+    pending: "asyncio.Queue[Optional[Tuple[int, Dict[str, Any]]]]" = asyncio.Queue()
+    results: "asyncio.Queue[Optional[Dict[str, Any]]]" = asyncio.Queue()
+    bucket = TokenBucket(rate_per_minute / 60, capacity=workers) if rate_per_minute > 0 else None
+
+    for index, record in enumerate(records):
+        if record_id(record, index) not in skip:
+            pending.put_nowait((index, record))
+    workers = max(1, min(workers, pending.qsize()))
+    for _ in range(workers):
+        pending.put_nowait(None)
+
+    async def worker() -> None:
+        while True:
+            item = await pending.get()
+            if item is None:
+                await results.put(None)
+                return
+            index, record = item
+            result: Dict[str, Any] = {"id": record_id(record, index)}
+            started = time.perf_counter()
+            try:
+                messages = build_final_messages(format_answers(record_pairs(record)))
+                if bucket is not None:
+                    await bucket.acquire()
+                response = await invoke(messages)
+                result.update(status="ok", prompt=response.content)
+            except Exception as e:
+                result.update(status="error", error=f"{type(e).__name__}: {e}")
+            result["seconds"] = round(time.perf_counter() - started, 3)
+            await results.put(result)
+
+    tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+    try:
+        running = workers
+        while running:
+            result = await results.get()
+            if result is None:
+                running -= 1
+            else:
+                yield result
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,351 @@
+# Offline benchmark for the /generate pipeline.
+#
+# Drives the FastAPI app in-process through complete sessions (/new_chat, then
+# the stage-1 and stage-2 answers through to the LLM3 finalize step) against the
+# local fake chat model, so it runs on a laptop with no network:
+#
+#     python bench.py --sessions 200 --concurrency 50 --token-latency 0.01
+#     python bench.py --replay conversations.jsonl --stream --json results.json
+#     python bench.py --memory 5000
+#
+# Reports p50/p95/p99 latency per endpoint and per stage, requests/sec,
+# event-loop lag and peak RSS per active session. --memory instead holds that
+# many synthetic finished transcripts at once, as LangChain message lists and as
+# transcript.Transcript, and reports the memory held per session by each.
+#
+# Needs httpx (the client FastAPI's own test tooling uses).
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+from interview import load_interview
+
+# Answers for one full interview: 4 stage-1 answers, then 7 stage-2 answers
+DEFAULT_ANSWERS = [
+    "E-commerce",
+    "Acme Outfitters",
+    "We sell outdoor clothing and camping gear online, with same-day shipping in major cities.",
+    "Online shoppers aged 25-45 who hike and camp on weekends.",
+    "Write product descriptions for new arrivals.",
+    "It keeps the catalogue consistent and saves our copywriters hours every week.",
+    "Yes, for every new product we list.",
+    "A short paragraph followed by bullet points.",
+    "Markdown with a bold product name as the title.",
+    "We send the product specs, the model returns a description in our brand voice.",
+    "Yes, reason about the customer's use case before writing.",
+]
+
+# Answers until the stage-2 transition and then until the LLM3 finalize step,
+# from the interview definition (interview.py); off-topic answers that need a
+# clarification add turns, so sessions run until the final prompt arrives
+STAGES = load_interview()["stages"]
+STAGE1_TURNS = len(STAGES[0]["questions"])
+STAGE2_TURNS = len(STAGES[1]["questions"])
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Offline benchmark for the prompt engine API")
+    parser.add_argument("--sessions", type=int, default=50, help="complete sessions to run")
+    parser.add_argument("--concurrency", type=int, default=10, help="sessions in flight at once")
+    parser.add_argument("--token-latency", type=float, default=0.01, help="fake model seconds per output token")
+    parser.add_argument("--input-token-latency", type=float, default=0.0, help="fake model seconds per input token")
+    parser.add_argument("--output-tokens", type=int, default=40, help="fake model tokens per reply")
+    parser.add_argument("--stream", action="store_true", help="use /generate/stream and report time to first token")
+    parser.add_argument("--replay", help="JSONL of recorded conversations to replay")
+    parser.add_argument("--backend", default="fake", help="model backend for every role (default: fake)")
+    parser.add_argument("--memory", type=int, metavar="SESSIONS", help="measure transcript memory per session instead")
+    parser.add_argument("--json", help="also write the results to this file")
+    return parser.parse_args(argv)
+
+def configure_environment(args: argparse.Namespace) -> None:
+    # Must run before main/models are imported: the registry reads these at import
+    for role in ("MODEL1_BACKEND", "MODEL2_BACKEND", "LLM3_BACKEND"):
+        os.environ[role] = args.backend
+    os.environ["FAKE_TOKEN_LATENCY"] = str(args.token_latency)
+    os.environ["FAKE_INPUT_TOKEN_LATENCY"] = str(args.input_token_latency)
+    os.environ["FAKE_OUTPUT_TOKENS"] = str(args.output_tokens)
+    os.environ.setdefault("FAKE_MAX_CONCURRENCY", str(max(args.concurrency * 2, 64)))
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+def load_conversations(path: str) -> List[List[str]]:
+    # Each line is either {"turns": ["answer 1", ...]} or any record with a text
+    # field (useCase, body or title) that is used as every answer of the session
+    conversations = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if isinstance(record.get("turns"), list) and record["turns"]:
+                conversations.append([str(turn) for turn in record["turns"]])
+                continue
+            text = record.get("useCase") or record.get("body") or record.get("title")
+            if text:
+                conversations.append([text] * (STAGE1_TURNS + STAGE2_TURNS))
+    if not conversations:
+        raise SystemExit(f"No conversations found in {path}")
+    return conversations
+
+def stage_of(result: Dict[str, Any], stage: int) -> str:
+    # Label a /generate turn from its reply: the stage-2 transition turn opens
+    # with the stage-2 banner, the last turn carries the final prompt
+    if result.get("is_final_prompt"):
+        return "finalize"
+    banner = STAGES[1].get("banner")
+    if banner and result["prompt"].startswith(banner):
+        return "stage1->2"
+    return f"stage{stage}"
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    # Nearest-rank percentile
+    rank = math.ceil(pct / 100 * len(ordered))
+    return ordered[min(max(rank, 1), len(ordered)) - 1]
+
+def peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024 # KiB on Linux
+
+
+class Recorder:
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.requests = 0
+        self.active_sessions = 0
+        self.peak_active_sessions = 0
+
+    def record(self, name: str, seconds: float) -> None:
+        self.samples[name].append(seconds)
+
+    def session_started(self) -> None:
+        self.active_sessions += 1
+        self.peak_active_sessions = max(self.peak_active_sessions, self.active_sessions)
+
+    def session_finished(self) -> None:
+        self.active_sessions -= 1
+
+
+async def post_turn(client, recorder: Recorder, endpoint: str, payload: Dict[str, Any], stream: bool) -> tuple:
+    # Returns (result, seconds, seconds to the first streamed event or None)
+    started = time.perf_counter()
+    recorder.requests += 1
+    first_token = None
+    if not stream:
+        response = await client.post(endpoint, json=payload)
+        if response.status_code != 200:
+            recorder.errors[endpoint] += 1
+            raise RuntimeError(f"{endpoint} returned {response.status_code}: {response.text}")
+        result = response.json()
+    else:
+        result = None
+        async with client.stream("POST", endpoint + "/stream", json=payload) as response:
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                event = json.loads(line)
+                if first_token is None and event["event"] in ("token", "banner"):
+                    first_token = time.perf_counter() - started
+                if event["event"] == "done":
+                    result = event
+                elif event["event"] == "error":
+                    recorder.errors[endpoint] += 1
+                    raise RuntimeError(f"{endpoint}/stream failed: {event['detail']}")
+    return result, time.perf_counter() - started, first_token
+
+async def run_session(client, recorder: Recorder, answers: List[str], stream: bool) -> None:
+    recorder.session_started()
+    try:
+        started = time.perf_counter()
+        response = await client.post("/new_chat", json={})
+        recorder.requests += 1
+        recorder.record("endpoint /new_chat", time.perf_counter() - started)
+        recorder.record("stage greeting", time.perf_counter() - started)
+        session_id = response.json()["session_id"]
+
+        stage = 1
+        # Clarification turns repeat a question, so allow for some extra turns
+        for turn in range(2 * (STAGE1_TURNS + STAGE2_TURNS)):
+            answer = answers[turn % len(answers)]
+            result, elapsed, first_token = await post_turn(
+                client, recorder, "/generate", {"useCase": answer, "session_id": session_id}, stream
+            )
+            label = stage_of(result, stage)
+            recorder.record("endpoint /generate", elapsed)
+            recorder.record(f"stage {label}", elapsed)
+            if stream:
+                recorder.record(f"ttft {label}", first_token if first_token is not None else elapsed)
+            if label == "stage1->2":
+                stage = 2
+            if result.get("is_final_prompt"):
+                break
+    finally:
+        recorder.session_finished()
+
+async def sample_loop_lag(samples: List[float], stop: asyncio.Event, interval: float = 0.01) -> None:
+    # How late the event loop wakes a sleeper: the delay every request waits on
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - started - interval))
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    import httpx
+    from main import app
+    from models import ROLES, get_model
+
+    for role in ROLES:
+        get_model(role) # build before measuring the RSS baseline
+    conversations = load_conversations(args.replay) if args.replay else [DEFAULT_ANSWERS]
+    recorder = Recorder()
+    lag_samples: List[float] = []
+    stop = asyncio.Event()
+    baseline_rss = peak_rss_bytes()
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        sampler = asyncio.create_task(sample_loop_lag(lag_samples, stop))
+        gate = asyncio.Semaphore(args.concurrency)
+        failures = 0
+        started = time.perf_counter()
+
+        async def one(answers: List[str]) -> None:
+            nonlocal failures
+            async with gate:
+                try:
+                    await run_session(client, recorder, answers, args.stream)
+                except Exception as e:
+                    failures += 1
+                    print(f"session failed: {e}", file=sys.stderr)
+
+        await asyncio.gather(*(one(answers) for answers in itertools.islice(itertools.cycle(conversations), args.sessions)))
+        wall = time.perf_counter() - started
+        stop.set()
+        await sampler
+
+    rss_growth = max(peak_rss_bytes() - baseline_rss, 0)
+    return {
+        "sessions": args.sessions,
+        "failed_sessions": failures,
+        "concurrency": args.concurrency,
+        "wall_seconds": wall,
+        "requests": recorder.requests,
+        "requests_per_second": recorder.requests / wall if wall else 0.0,
+        "latency": {
+            name: {
+                "count": len(values),
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "p99": percentile(values, 99),
+            }
+            for name, values in sorted(recorder.samples.items())
+        },
+        "event_loop_lag": {
+            "p50": percentile(lag_samples, 50),
+            "p99": percentile(lag_samples, 99),
+            "max": max(lag_samples, default=0.0),
+        },
+        "peak_active_sessions": recorder.peak_active_sessions,
+        "peak_rss_growth_bytes": rss_growth,
+        "peak_rss_bytes_per_active_session": rss_growth / recorder.peak_active_sessions if recorder.peak_active_sessions else 0.0,
+        "errors": dict(recorder.errors),
+    }
+
+def synthetic_transcript(answers: List[str]) -> List[tuple]:
+    # (role, text) entries of a finished interview: the stage system prompts,
+    # each scripted question and the user's answer
+    from prompts import SYSTEM_PROMPTS
+
+    entries = []
+    answers = iter(itertools.cycle(answers))
+    for stage in STAGES:
+        entries.append(("system", SYSTEM_PROMPTS[stage["system_prompt"]]))
+        for question in stage["questions"]:
+            entries.append(("ai", question["template"]))
+            entries.append(("user", next(answers)))
+    return entries
+
+def measure_memory(count: int, answers: List[str]) -> Dict[str, Any]:
+    from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
+    from transcript import Transcript
+
+    entries = synthetic_transcript(answers)
+
+    def fresh(role: str, text: str) -> str:
+        # Each session gets its own copy of the conversation text, as if it came
+        # off the wire; the system prompts are shared module strings either way
+        return text if role == "system" else (text + " ")[:-1]
+
+    def as_messages() -> Any:
+        # The previous session layout: a message object per entry
+        types = {"system": SystemMessage, "user": HumanMessage, "ai": AIMessage}
+        return {
+            "chat_history": [types[role](content=fresh(role, text)) for role, text in entries],
+            "messages_sent_to_frontend": []
+        }
+
+    def as_transcript() -> Any:
+        transcript = Transcript()
+        for role, text in entries:
+            {"system": transcript.add_system, "user": transcript.add_user, "ai": transcript.add_ai}[role](fresh(role, text))
+        return {"chat_history": transcript}
+
+    results: Dict[str, Any] = {"sessions": count, "entries_per_session": len(entries)}
+    for name, build in (("messages", as_messages), ("transcript", as_transcript)):
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        held = [build() for _ in range(count)]
+        used = tracemalloc.get_traced_memory()[0] - baseline
+        tracemalloc.stop()
+        results[name] = {"bytes_per_session": used / count}
+        del held
+    results["transcript"]["nbytes_per_session"] = as_transcript()["chat_history"].nbytes()
+    results["reduction"] = results["messages"]["bytes_per_session"] / max(results["transcript"]["bytes_per_session"], 1)
+    return results
+
+def print_memory_report(results: Dict[str, Any]) -> None:
+    print(f"{results['sessions']} sessions, {results['entries_per_session']} transcript entries each")
+    for name in ("messages", "transcript"):
+        print(f"{name:<12}{results[name]['bytes_per_session'] / 1024:>10.1f} KiB/session")
+    print(f"reduction: {results['reduction']:.1f}x")
+
+def print_report(results: Dict[str, Any]) -> None:
+    print(f"sessions: {results['sessions']} ({results['failed_sessions']} failed), concurrency {results['concurrency']}")
+    print(f"wall: {results['wall_seconds']:.2f}s  requests: {results['requests']}  req/s: {results['requests_per_second']:.1f}")
+    print(f"\n{'latency (ms)':<28}{'count':>8}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for name, row in results["latency"].items():
+        print(f"{name:<28}{row['count']:>8}{row['p50'] * 1000:>10.1f}{row['p95'] * 1000:>10.1f}{row['p99'] * 1000:>10.1f}")
+    lag = results["event_loop_lag"]
+    print(f"\nevent loop lag (ms): p50 {lag['p50'] * 1000:.2f}  p99 {lag['p99'] * 1000:.2f}  max {lag['max'] * 1000:.2f}")
+    print(
+        f"peak RSS growth: {results['peak_rss_growth_bytes'] / 2**20:.1f} MiB over "
+        f"{results['peak_active_sessions']} active sessions "
+        f"({results['peak_rss_bytes_per_active_session'] / 1024:.1f} KiB/session)"
+    )
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    if args.memory:
+        results = measure_memory(args.memory, DEFAULT_ANSWERS)
+        print_memory_report(results)
+    else:
+        configure_environment(args)
+        results = asyncio.run(run(args))
+        print_report(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
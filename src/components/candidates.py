@@ -0,0 +1,117 @@
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
+import logging
+import re
+import time
+
+# Self-consistency fan-out for the LLM3 step. k candidates are generated
+# concurrently from the same messages; once the first one is back, the others
+# get a grace period proportional to how long it took, stragglers are cancelled
+# (nothing runs past the overall deadline), and the best finished candidate
+# is picked by cheap heuristics or, optionally, by one judge call. Wall-clock
+# time stays close to a single call: the grace period is a fraction of it.
+
+logger = logging.getLogger("prompt_engine.candidates")
+
+_WORD = re.compile(r"[a-z0-9][a-z0-9'-]{3,}")
+_META = re.compile(r"^\s*(here is|here's|sure|certainly|i hope|as an ai)\b|\blet me know if\b", re.IGNORECASE | re.MULTILINE)
+_PLACEHOLDER = re.compile(r"\[(insert|your|add|placeholder)[^\]]*\]|<(insert|your)[^>]*>|\bTODO\b", re.IGNORECASE)
+_STRUCTURE = re.compile(r"^\s*(#+ |\*\*[^*]+\*\*|[-*] |\d+[.)] )", re.MULTILINE)
+
+def score_prompt(text: str, answers: List[str]) -> float:
+    # Higher is better. Rewards covering the user's answers and a structured,
+    # self-contained prompt; penalises chatter, placeholders and questions back
+    # to the user. Only meant to rank candidates for the same answers.
+    text = text.strip()
+    if not text:
+        return float("-inf")
+    lowered = text.lower()
+    keywords = {word for answer in answers for word in _WORD.findall(answer.lower())}
+    coverage = sum(1 for word in keywords if word in lowered) / len(keywords) if keywords else 0.0
+    length = len(text.split())
+    score = 4.0 * coverage
+    score += min(len(_STRUCTURE.findall(text)), 12) * 0.1
+    score += 0.5 if re.search(r"\byou are\b|\bact as\b|\byour role\b", lowered) else 0.0
+    score -= 0.0 if 150 <= length <= 900 else 1.0
+    score -= 1.0 * len(_META.findall(text))
+    score -= 0.5 * len(_PLACEHOLDER.findall(text))
+    score -= 1.0 if text.rstrip().endswith("?") else 0.0
+    return score
+
+class CandidatesTimeout(asyncio.TimeoutError):
+    # No candidate finished within the deadline
+    def __init__(self, deadline: float):
+        super().__init__(f"no finalize candidate finished within {deadline:g}s")
+        self.deadline = deadline
+
+def parse_choice(text: str, count: int) -> Optional[int]:
+    # The judge answers with a candidate number
+    match = re.search(r"\d+", text)
+    if match and 1 <= int(match.group()) <= count:
+        return int(match.group()) - 1
+    return None
+
+async def best_of(
+    generate: Callable[[int], Awaitable[str]],
+    k: int,
+    answers: List[str],
+    deadline: float,
+    grace_ratio: float = 0.3,
+    judge: Optional[Callable[[List[str]], Awaitable[str]]] = None,
+) -> Tuple[str, Dict[str, Any]]:
+    # `generate(i)` produces candidate i. Returns the chosen text and a summary
+    # (finished/cancelled counts, scores, the winner's index as "picked" and how
+    # it was picked). Raises CandidatesTimeout when no candidate is back by `deadline`.
+    started = time.perf_counter()
+    tasks = {asyncio.create_task(generate(i)): i for i in range(k)}
+    finished: List[Tuple[int, str]] = []
+    errors: List[BaseException] = []
+    pending = set(tasks)
+    try:
+        window_end = started + deadline
+        first_back = False
+        while pending:
+            timeout = window_end - time.perf_counter()
+            if timeout <= 0:
+                break
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    errors.append(task.exception())
+                else:
+                    finished.append((tasks[task], task.result()))
+            if finished and not first_back:
+                # The rest get a fraction of the first candidate's time
+                first_back = True
+                now = time.perf_counter()
+                window_end = min(window_end, now + grace_ratio * (now - started))
+        if not finished:
+            if errors and not pending:
+                raise errors[-1]
+            raise CandidatesTimeout(deadline)
+    finally:
+        for task in pending:
+            task.cancel()
+
+    scores = [score_prompt(text, answers) for _, text in finished]
+    best = max(range(len(finished)), key=lambda i: scores[i])
+    picked_by = "heuristic"
+    if judge is not None and len(finished) > 1:
+        try:
+            choice = parse_choice(await judge([text for _, text in finished]), len(finished))
+        except Exception as e:
+            logger.warning("finalize judge failed (%s), using the heuristic pick", type(e).__name__)
+            choice = None
+        if choice is not None:
+            best, picked_by = choice, "judge"
+    summary = {
+        "candidates": k,
+        "finished": len(finished),
+        "failed": len(errors),
+        "cancelled": len(pending),
+        "scores": [round(score, 3) for score in scores],
+        "picked": finished[best][0],
+        "picked_by": picked_by,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+    return finished[best][1], summary
@@ -0,0 +1,76 @@
+from typing import Any, List, Optional, Tuple
+
+from langchain_core.messages import SystemMessage
+from transcript import SYSTEM, Transcript
+
+# Context compaction for the interview models. The session keeps the full
+# transcript (LLM3 needs it for formatted_history, see transcript.py), but each
+# model1/model2 call only gets:
+#   stage 1: system_message_1 + the most recent turns that fit the budget
+#   stage N: the stage's system message + a compact "business context" record
+#            of the answers from every earlier stage + the most recent turns of
+#            stage N that fit the budget
+# (The default interview has two stages; an INTERVIEW_FILE may define more.)
+#
+# The layout is prefix-stable: the most widely shared part comes first (the
+# stage system prompt, identical for every session), then the per-session
+# record, then the turns, and each call appends to the previous call's input
+# byte for byte. When the turns outgrow the budget, the window start jumps
+# forward so they fit in half of it, and stays there until the budget is
+# reached again. So a backend's prefix/KV cache (see prefix_cache.py) stays
+# valid for several turns, instead of every turn shifting the window by one.
+
+CHARS_PER_TOKEN = 4 # close enough for budgeting English text with Gemma/Gemini tokenizers
+
+def text_tokens(text: str) -> int:
+    # Rough estimate: ~4 characters per token plus a few tokens of per-message framing
+    return len(text) // CHARS_PER_TOKEN + 4
+
+def count_tokens(messages: List[Any]) -> int:
+    return sum(text_tokens(msg.content) for msg in messages)
+
+def transcript_tokens(history: Transcript, start: int = 0, end: Optional[int] = None) -> int:
+    return sum(text_tokens(text) for _, text in history.entries(start, end))
+
+def stage_bounds(history: Transcript, stage: int) -> Tuple[int, int]:
+    # Index of the stage's system message and the end of its transcript (the
+    # next stage's system message, or the end of the history). Every stage's
+    # transcript opens with its system message.
+    systems = [i for i, role in enumerate(history.roles) if role == SYSTEM]
+    start = systems[min(stage, len(systems)) - 1]
+    end = systems[stage] if stage < len(systems) else len(history)
+    return start, end
+
+def business_context(pairs: List[Tuple[str, str]], through_stage: int = 1) -> str:
+    # Collapse the answers of the completed stages into a compact record
+    levels = "Level 1" if through_stage == 1 else f"Levels 1-{through_stage}"
+    lines = [f"Business context collected in {levels} (summary of the earlier conversation):"]
+    lines.extend(f"- {label}: {answer}" for label, answer in pairs)
+    return "\n".join(lines)
+
+def _recent_turns(texts: List[str], budget: int) -> int:
+    # How many of the newest turns fit the budget; the latest is always kept
+    kept = 0
+    used = 0
+    for text in reversed(texts):
+        cost = text_tokens(text)
+        if kept and used + cost > budget:
+            break
+        kept += 1
+        used += cost
+    return kept
+
+def compact_history(history: Transcript, stage: int, record: Optional[str], budget: int,
+                    start: int = 0) -> Tuple[List[Any], int]:
+    # Returns the messages for the call and the window start (an index into
+    # `history`) to pass back in on the next call of the session
+    split, end = stage_bounds(history, stage)
+    prefix = history.to_messages(split, split + 1)
+    if stage > 1 and record:
+        prefix.append(SystemMessage(content=record))
+    first = split + 1
+    budget = max(budget - count_tokens(prefix), 0)
+    start = max(start, first)
+    if transcript_tokens(history, start, end) > budget:
+        start = end - _recent_turns(history.texts[first:end], budget // 2)
+    return prefix + history.to_messages(start, end), start
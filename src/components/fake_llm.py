@@ -0,0 +1,71 @@
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+import asyncio
+import time
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# Local stand-in chat model for benchmarks and offline runs. It makes no network
+# calls: it "prefills" at input_token_latency per input token, then emits
+# output_tokens tokens at token_latency each, ending in a question like the real
+# interviewers do.
+
+FILLER = "Thanks for sharing that, it helps a lot. To shape the prompt further".split()
+
+class FakeChatModel(BaseChatModel):
+    model_id: str = "fake-chat"
+    token_latency: float = 0.02
+    input_token_latency: float = 0.0
+    output_tokens: int = 40
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {
+            "model_id": self.model_id,
+            "token_latency": self.token_latency,
+            "input_token_latency": self.input_token_latency,
+            "output_tokens": self.output_tokens,
+        }
+
+    def _prefill_seconds(self, messages: List[BaseMessage]) -> float:
+        return self.input_token_latency * sum(len(msg.content) // 4 for msg in messages)
+
+    def _tokens(self) -> List[str]:
+        count = max(self.output_tokens, 2)
+        words = [FILLER[i % len(FILLER)] for i in range(count - 2)]
+        return [" " + word for word in words] + [" could you tell me more", "?"]
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        tokens = self._tokens()
+        time.sleep(self._prefill_seconds(messages) + self.token_latency * len(tokens))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens).strip()))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        tokens = self._tokens()
+        await asyncio.sleep(self._prefill_seconds(messages) + self.token_latency * len(tokens))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens).strip()))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self._prefill_seconds(messages))
+        for token in self._tokens():
+            time.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self._prefill_seconds(messages))
+        for token in self._tokens():
+            await asyncio.sleep(self.token_latency)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
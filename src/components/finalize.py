@@ -0,0 +1,93 @@
+from typing import Any, List, Sequence, Tuple
+
+from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
+from prompts import system_message_3
+
+# Building the LLM3 input, shared by the interactive flow (main.run_turn) and
+# batch generation (batch.py), so both produce the same final prompt request.
+
+FINALIZE_INSTRUCTION = "Please generate the final comprehensive prompt based on the provided chat history."
+
+def format_history(chat_history: List[Any]) -> str:
+    # Format the existing chat history (excluding the stage system messages that are not meant for LLM3 to "talk" to)
+    formatted_history = []
+    for msg in chat_history:
+        if isinstance(msg, HumanMessage):
+            formatted_history.append(f"User: {msg.content}")
+        elif isinstance(msg, AIMessage):
+            formatted_history.append(f"AI: {msg.content}")
+    return "\n".join(formatted_history)
+
+def format_answers(pairs: Sequence[Tuple[str, str]]) -> str:
+    # Same layout as format_history, for question/answer pairs known up front
+    return "\n".join(f"AI: {question}\nUser: {answer}" for question, answer in pairs)
+
+def build_final_messages(formatted_history: str) -> List[Any]:
+    # The messages passed to LLM3 should primarily be the instruction for LLM3 itself
+    # and then a single "HumanMessage" that LLM3 is supposed to respond to, containing the context.
+    # Here, we're making the entire instruction and context part of the system message,
+    # then giving a short human message to trigger the response.
+    # Given system_message_3 expects {chat_history} as a string, this formatting is better
+    # than passing the message objects themselves.
+    return [
+        SystemMessage(content=system_message_3.format(chat_history=formatted_history)),
+        HumanMessage(content=FINALIZE_INSTRUCTION)
+    ]
+
+# Speculative finalize (see speculation.py): a draft is generated from the
+# transcript before the last answer arrives, and only this short refinement runs
+# once it does. The refinement input is the draft plus the new exchange instead
+# of system_message_3 and the whole transcript, and its output is only the
+# section the last answer adds, appended to the draft (output tokens are most of
+# the cost of a finalize, so regenerating the whole prompt would save little).
+REFINE_INSTRUCTION = """
+You are a senior prompt engineer finishing a prompt that you drafted from an interview with a user.
+The draft was written before the user's last answer, which is given below together with the question it answers.
+Do not repeat or rewrite the draft. Write only the section to add at the end of the prompt for this answer: a short heading and a few sentences or bullet points, in the same style as the draft.
+If the draft already covers the answer, reply with NO CHANGE.
+Do not add commentary, do not ask questions and do not mention the draft.
+"""
+
+NO_CHANGE = "NO CHANGE"
+
+def refinement_text(reply: str) -> str:
+    # What to append to the draft for the refinement's reply
+    addition = reply.strip()
+    if not addition or addition.upper().rstrip(".") == NO_CHANGE:
+        return ""
+    return f"\n\n{addition}"
+
+def build_refine_messages(draft: str, new_exchange: str) -> List[Any]:
+    return [
+        SystemMessage(content=REFINE_INSTRUCTION),
+        HumanMessage(content=f"Draft prompt:\n{draft}\n\nNew information from the interview:\n{new_exchange}")
+    ]
+
+# Near-duplicate finalize (see semantic_index.py): an existing prompt written for
+# a very similar set of answers is rewritten for this user's answers
+ADAPT_INSTRUCTION = """
+You are a senior prompt engineer. Below is a finished prompt that was written for another business with very similar requirements, followed by the answers of the current user.
+Rewrite the prompt for the current user: replace every business-specific detail (name, products, audience, goals, formats, examples) with theirs, adjust any part their answers change, and keep everything else.
+Return only the final prompt, with no commentary.
+"""
+
+def build_adapt_messages(existing_prompt: str, formatted_answers: str) -> List[Any]:
+    return [
+        SystemMessage(content=ADAPT_INSTRUCTION),
+        HumanMessage(content=f"Existing prompt:\n{existing_prompt}\n\nCurrent user's answers:\n{formatted_answers}")
+    ]
+
+# Self-consistency fan-out (see candidates.py): with FINALIZE_JUDGE=1, LLM3 picks
+# the best of the finished candidates in one short call
+JUDGE_INSTRUCTION = """
+You are a senior prompt engineer reviewing candidate prompts written for the same user.
+Pick the candidate that best covers every one of the user's answers, is clearly structured and is ready to use as is, with no commentary or placeholders.
+Answer with the number of the best candidate only.
+"""
+
+def build_judge_messages(candidates: Sequence[str], formatted_answers: str) -> List[Any]:
+    listing = "\n\n".join(f"Candidate {i}:\n{text}" for i, text in enumerate(candidates, start=1))
+    return [
+        SystemMessage(content=JUDGE_INSTRUCTION),
+        HumanMessage(content=f"User's answers:\n{formatted_answers}\n\n{listing}")
+    ]
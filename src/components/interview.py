@@ -0,0 +1,216 @@
+from typing import Any, Dict, List, Optional
+import json
+import os
+import re
+
+from prompts import STAGE1_QUESTIONS, STAGE2_QUESTIONS
+
+# Data-driven interview. The stages, their questions and when to move on are
+# plain data (INTERVIEW below, or a JSON file with the same shape given by
+# INTERVIEW_FILE). The engine decides what each turn needs:
+#   "ask"      the next scripted question, rendered from its template - no model call
+#   "model"    a model call on the stage's role, to clarify an off-topic or
+#              incomplete answer, to rephrase (INTERVIEW_REPHRASE=1), or for every
+#              turn in INTERVIEW_MODE=llm (the free-form interview driven by the
+#              stage system prompts)
+#   "finalize" all stages are done; the caller runs the LLM3 step
+#
+# The engine itself makes no calls and keeps its state on the session dict
+# ("stage", "question_count", "answers", "clarifications"), so the API
+# (main.py) and the CLI loops (agent.py, agent_llm.py) drive it the same way.
+#
+# Question templates may refer to earlier answers by key, e.g.
+# "What products or services does {business_name} offer?"; unknown keys render
+# as "your business". A question may also set "min_chars" and
+# "screen_off_topic": false, for questions about what the prompt should do,
+# where "write me ..." is the answer rather than an off-topic request.
+
+INTERVIEW: Dict[str, Any] = {
+    "stages": [
+        {
+            "name": "business_context",
+            "title": "Level 1 Business Context",
+            "role": "model1",
+            "system_prompt": "stage1",
+            "greeting": "Hello, and welcome! Level 1 Business Context: I'll ask you a few short questions about your business so we can build the right prompt for you.",
+            "questions": [
+                {"key": "industry", "label": "Industry", "template": STAGE1_QUESTIONS[0]},
+                {"key": "business_name", "label": "Business name", "template": STAGE1_QUESTIONS[1]},
+                {"key": "offering", "label": "Products/services", "template": "What products or services does {business_name} offer? Please describe them in detail."},
+                {"key": "audience", "label": "Target audience", "template": STAGE1_QUESTIONS[3]},
+            ],
+        },
+        {
+            "name": "prompt_design",
+            "title": "Level 2 Prompt Design",
+            "role": "model2",
+            "system_prompt": "stage2",
+            "banner": "Switching to Level 2 Prompt Design...",
+            "greeting": "Level 2 Prompt Design: thanks, that gives me a clear picture of {business_name}. Now let's design the prompt itself.",
+            "questions": [
+                {"key": "purpose", "label": "Purpose", "template": STAGE2_QUESTIONS[0], "screen_off_topic": False},
+                {"key": "business_value", "label": "How it helps the business", "template": STAGE2_QUESTIONS[1]},
+                {"key": "reuse", "label": "Reuse", "template": STAGE2_QUESTIONS[2]},
+                {"key": "outputs", "label": "Desired outputs", "template": STAGE2_QUESTIONS[3], "screen_off_topic": False},
+                {"key": "format", "label": "Output format", "template": STAGE2_QUESTIONS[4], "screen_off_topic": False},
+                {"key": "example", "label": "Example conversation", "template": STAGE2_QUESTIONS[5], "screen_off_topic": False},
+                {"key": "reasoning", "label": "Multi-step reasoning", "template": STAGE2_QUESTIONS[6]},
+            ],
+        },
+    ],
+    "finalize_banner": "Finalizing prompt using advanced engineer (LLM3)...",
+    "acknowledgements": ["Thanks!", "Got it.", "Great, thank you.", "Perfect."],
+}
+
+# Answers that ask the assistant for something other than prompt engineering
+# ("can you write me a script", "please solve this"); describing a business that
+# writes code or solves problems is an ordinary answer
+OFF_TOPIC = re.compile(
+    r"\b(can|could|would|will)\s+you\s+(please\s+)?(write|solve|fix|debug|code)\b"
+    r"|^\s*(please\s+)?(write|solve|fix|debug)\s+(me|my|this)\b"
+    r"|\bplease\s+(write|solve|fix|debug)\b"
+    r"|```|\bdef \w+\(",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+def load_interview() -> Dict[str, Any]:
+    path = os.getenv("INTERVIEW_FILE")
+    if not path:
+        return INTERVIEW
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+class InterviewComplete(Exception):
+    # An answer arrived for a session whose questions are all answered (its
+    # final prompt is being generated or already was)
+    pass
+
+
+class _Answers(dict):
+    def __missing__(self, key: str) -> str:
+        return "your business"
+
+
+class Step:
+    __slots__ = ("kind", "stage", "role", "text", "hint", "banner", "transition", "cache")
+
+    def __init__(self, kind: str, stage: int, role: Optional[str] = None, text: str = "", hint: Optional[str] = None,
+                 banner: Optional[str] = None, transition: bool = False, cache: bool = False):
+        self.kind = kind
+        self.stage = stage
+        self.role = role
+        self.text = text
+        self.hint = hint
+        self.banner = banner
+        self.transition = transition
+        self.cache = cache
+
+
+class InterviewEngine:
+    def __init__(self, definition: Dict[str, Any], mode: str = "scripted", rephrase: bool = False,
+                 max_clarifications: int = 2, min_answer_chars: int = 2):
+        self.definition = definition
+        self.stages: List[Dict[str, Any]] = definition["stages"]
+        self.mode = mode
+        self.rephrase = rephrase
+        self.max_clarifications = max_clarifications
+        self.min_answer_chars = min_answer_chars
+
+    def stage(self, number: int) -> Dict[str, Any]:
+        return self.stages[number - 1]
+
+    def new_state(self) -> Dict[str, Any]:
+        return {"stage": 1, "question_count": 0, "answers": {}, "clarifications": 0}
+
+    def render(self, template: str, state: Dict[str, Any]) -> str:
+        return template.format_map(_Answers(state["answers"]))
+
+    def question(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        return self.stage(state["stage"])["questions"][state["question_count"]]
+
+    def check(self, question: Dict[str, Any], text: str) -> Optional[str]:
+        # Why an answer needs the model's attention, or None when it can be taken as is
+        answer = text.strip()
+        if len(answer) < question.get("min_chars", self.min_answer_chars):
+            return "the answer is empty or too short"
+        if question.get("screen_off_topic", True) and OFF_TOPIC.search(answer):
+            return "the user asked for help unrelated to prompt engineering"
+        if answer.endswith("?") and len(answer.split()) <= 12:
+            return "the user asked a question instead of answering"
+        return None
+
+    def answer_pairs(self, state: Dict[str, Any], stage: int) -> List[tuple]:
+        # (label, answer) for the answered questions of a stage
+        return [
+            (question.get("label", question["key"]), state["answers"][question["key"]])
+            for question in self.stage(stage)["questions"]
+            if question["key"] in state["answers"]
+        ]
+
+    def _ask(self, state: Dict[str, Any], text: str, **kwargs: Any) -> Step:
+        stage = self.stage(state["stage"])
+        if self.mode == "llm":
+            return Step("model", state["stage"], stage["role"], **kwargs)
+        question = self.render(self.question(state)["template"], state)
+        if self.rephrase:
+            hint = f"Briefly acknowledge the user's last answer, then ask exactly one question, rephrased naturally: {question}"
+            return Step("model", state["stage"], stage["role"], hint=hint, **kwargs)
+        return Step("ask", state["stage"], stage["role"], text=f"{text} {question}".strip(), **kwargs)
+
+    def start(self, state: Dict[str, Any]) -> Step:
+        stage = self.stage(1)
+        if self.mode == "llm":
+            # Free-form greeting from the stage-1 system prompt (cacheable: fixed input)
+            return Step("model", 1, stage["role"], cache=True)
+        return self._ask(state, self.render(stage["greeting"], state))
+
+    def answer(self, state: Dict[str, Any], text: str) -> Step:
+        # Record the user's reply and decide the next step; mutates `state`
+        stage = self.stage(state["stage"])
+        if state["question_count"] >= len(stage["questions"]):
+            raise InterviewComplete("every question of the interview has been answered")
+        question = self.question(state)
+        if self.mode != "llm":
+            reason = self.check(question, text)
+            if reason and state["clarifications"] < self.max_clarifications:
+                state["clarifications"] += 1
+                hint = (
+                    f"The user's last reply did not answer the question \"{self.render(question['template'], state)}\" "
+                    f"({reason}). Respond politely in one or two sentences, declining anything unrelated to prompt "
+                    "engineering, and ask the same question again."
+                )
+                return Step("model", state["stage"], stage["role"], hint=hint)
+
+        state["answers"][question["key"]] = text.strip()
+        state["question_count"] += 1
+        state["clarifications"] = 0
+
+        if state["question_count"] < len(stage["questions"]):
+            acknowledgements = self.definition.get("acknowledgements") or [""]
+            return self._ask(state, acknowledgements[len(state["answers"]) % len(acknowledgements)])
+
+        if state["stage"] == len(self.stages):
+            return Step("finalize", state["stage"], banner=self.definition.get("finalize_banner"))
+
+        # Move to the next stage and open it
+        state["stage"] += 1
+        state["question_count"] = 0
+        following = self.stage(state["stage"])
+        if self.mode == "llm":
+            return Step("model", state["stage"], following["role"], banner=following.get("banner"), transition=True, cache=True)
+        return self._ask(state, self.render(following["greeting"], state), banner=following.get("banner"), transition=True)
+
+
+def create_interview_engine(stages: Optional[List[Dict[str, Any]]] = None) -> InterviewEngine:
+    # INTERVIEW_MODE=scripted (default) | llm; `stages` restricts the interview
+    # to a subset (agent_llm.py only runs the business-context stage)
+    definition = load_interview()
+    if stages is not None:
+        definition = {**definition, "stages": stages}
+    return InterviewEngine(
+        definition,
+        mode=os.getenv("INTERVIEW_MODE", "scripted").lower(),
+        rephrase=os.getenv("INTERVIEW_REPHRASE", "0") == "1",
+        max_clarifications=int(os.getenv("INTERVIEW_MAX_CLARIFICATIONS", "2")),
+    )
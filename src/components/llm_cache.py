@@ -0,0 +1,144 @@
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Response cache for model calls whose input is fixed, such as the opening
+# greeting (system_message_1 only) and the stage-2 opener (system_message_2
+# only). Entries are keyed on the role's backends (the names configured in
+# models.ROLES) and a hash of the message list, so changing a prompt or a
+# backend never serves stale text, and a lookup never has to build a client.
+# A backend's parameters live in models.py: clear a disk cache after changing
+# them.
+#
+# A greeting pool keeps `pool_size` variants per input and rotates through them,
+# so users do not all see the same word-for-word opening. Each variant is
+# generated once by the model (on first use, or by warm()) and then cached.
+
+def model_fingerprint(model: Any) -> Dict[str, Any]:
+    params = getattr(model, "_identifying_params", None) or {}
+    llm = getattr(model, "llm", None) # ChatHuggingFace wraps the endpoint
+    if llm is not None:
+        params = {**params, **(getattr(llm, "_identifying_params", None) or {})}
+    model_id = (
+        getattr(model, "model_id", None)
+        or getattr(model, "model", None)
+        or getattr(llm, "repo_id", None)
+        or type(model).__name__
+    )
+    return {"model": model_id, "params": params}
+
+def cache_key(backends: List[str], messages: List[Any], variant: int = 0) -> str:
+    payload = {
+        "backends": list(backends),
+        "messages": [[msg.type, msg.content] for msg in messages],
+        "variant": variant,
+    }
+    raw = json.dumps(payload, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    def __init__(self, pool_size: int = 1):
+        self.pool_size = max(pool_size, 1)
+        self._rotation: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def next_key(self, backends: List[str], messages: List[Any]) -> str:
+        # Key for the next greeting-pool slot of this input
+        base = cache_key(backends, messages)
+        slot = self._rotation.get(base, 0)
+        self._rotation[base] = (slot + 1) % self.pool_size
+        return cache_key(backends, messages, slot)
+
+    async def get(self, key: str) -> Optional[str]:
+        text = await self._read(key)
+        if text is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return text
+
+    async def _read(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    async def put(self, key: str, text: str) -> None:
+        raise NotImplementedError
+
+    async def warm(self, backends: List[str], messages: List[Any], invoke: Callable[[], Awaitable[Any]]) -> None:
+        # Fill every pool slot for this input ahead of the first user. `invoke`
+        # makes the model call (through the router, see main.warm_reply); the
+        # lookups here are not counted as hits or misses.
+        for slot in range(self.pool_size):
+            key = cache_key(backends, messages, slot)
+            if await self._read(key) is None:
+                response = await invoke()
+                await self.put(key, response.content)
+
+
+class MemoryLLMCache(LLMCache):
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 86400, pool_size: int = 1):
+        super().__init__(pool_size)
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict() # key -> (stored_at, text)
+
+    async def _read(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() - entry[0] > self.ttl_seconds:
+            self._entries.pop(key, None)
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    async def put(self, key: str, text: str) -> None:
+        self._entries[key] = (time.monotonic(), text)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+class DiskLLMCache(LLMCache):
+    # Survives restarts and is shared by the workers on a host
+    def __init__(self, path: str, ttl_seconds: float = 86400, pool_size: int = 1):
+        super().__init__(pool_size)
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, text TEXT NOT NULL, stored_at REAL NOT NULL)")
+
+    def _execute(self, sql: str, params: tuple = ()) -> List[tuple]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    async def _read(self, key: str) -> Optional[str]:
+        rows = await asyncio.to_thread(
+            self._execute, "SELECT text FROM llm_cache WHERE key = ? AND stored_at > ?", (key, time.time() - self.ttl_seconds)
+        )
+        return rows[0][0] if rows else None
+
+    async def put(self, key: str, text: str) -> None:
+        await asyncio.to_thread(
+            self._execute, "INSERT OR REPLACE INTO llm_cache (key, text, stored_at) VALUES (?, ?, ?)", (key, text, time.time())
+        )
+
+
+def create_llm_cache() -> Optional[LLMCache]:
+    # LLM_CACHE=memory (default) | disk | off
+    kind = os.getenv("LLM_CACHE", "memory").lower()
+    ttl_seconds = float(os.getenv("LLM_CACHE_TTL_SECONDS", "86400"))
+    pool_size = int(os.getenv("GREETING_POOL_SIZE", "1"))
+    if kind == "off":
+        return None
+    if kind == "disk":
+        return DiskLLMCache(os.getenv("LLM_CACHE_PATH", "llm_cache.db"), ttl_seconds, pool_size)
+    if kind != "memory":
+        raise ValueError(f"Unknown LLM_CACHE: {kind}")
+    return MemoryLLMCache(int(os.getenv("LLM_CACHE_MAX", "256")), ttl_seconds, pool_size)
@@ -0,0 +1,373 @@
+from concurrent.futures import ThreadPoolExecutor
+import copy
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+import asyncio
+import logging
+import time
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from prefix_cache import PrefixCache
+
+# Local CPU inference for the interviewer roles (the "local" backend). A small
+# instruction-tuned model (google/gemma-2-2b-it by default, LOCAL_MODEL_ID) is
+# loaded with transformers and its Linear layers quantized to int8
+# (torch dynamic quantization), so it runs in a few GB of RAM without a GPU.
+#
+# Concurrent turns from different sessions are batched: the scheduler collects
+# requests until it has `max_batch` of them or the oldest has waited `max_wait`
+# seconds, runs them through one left-padded generate() call, and streams each
+# row's tokens back to its caller as they are decoded. A row that hits EOS stops
+# streaming at once; the next batch starts as soon as the running one finishes.
+#
+# A call that runs on its own (batch of one, i.e. whenever the server is not
+# saturated) resumes from the KV cache of the longest prefix already computed:
+# the system prompt shared by all sessions, or the session's previous call (see
+# prefix_cache.py). Only the new tokens are prefilled, so late turns cost about
+# the same as early ones. Batched rows are left-padded and prefill in full.
+#
+# torch and transformers are only needed when this backend is selected:
+#   pip install torch transformers
+
+logger = logging.getLogger("prompt_engine.local_llm")
+
+
+def to_chat_turns(messages: List[BaseMessage]) -> List[Dict[str, str]]:
+    # Gemma's chat template has no system role and expects alternating
+    # user/model turns starting with the user. Leading system messages become a
+    # preamble of the first user turn; later ones (e.g. clarification hints) are
+    # appended to the latest user turn.
+    preamble: List[str] = []
+    turns: List[Dict[str, str]] = []
+    for msg in messages:
+        if msg.type == "system":
+            user_turns = [turn for turn in turns if turn["role"] == "user"]
+            if user_turns:
+                user_turns[-1]["content"] += f"\n\n{msg.content}"
+            else:
+                preamble.append(msg.content)
+            continue
+        role = "model" if msg.type == "ai" else "user"
+        if turns and turns[-1]["role"] == role:
+            turns[-1]["content"] += f"\n\n{msg.content}"
+        else:
+            turns.append({"role": role, "content": msg.content})
+    if not turns or turns[0]["role"] != "user":
+        turns.insert(0, {"role": "user", "content": ""})
+    if preamble:
+        turns[0]["content"] = "\n\n".join(preamble + [turns[0]["content"]]).strip()
+    if turns[-1]["role"] != "user":
+        # Nothing new from the user (e.g. a stage opener): ask for the next turn
+        turns.append({"role": "user", "content": "Please continue."})
+    return turns
+
+
+class LocalEngine:
+    # The loaded model and tokenizer; generate() is blocking and runs on the
+    # scheduler's single worker thread
+    def __init__(self, model_id: str, threads: int = 0, quantize: bool = True, prefix_cache_tokens: int = 0):
+        try:
+            import torch
+            from transformers import AutoModelForCausalLM, AutoTokenizer
+        except ImportError as e:
+            raise RuntimeError("The local backend needs torch and transformers: pip install torch transformers") from e
+
+        self.torch = torch
+        if threads > 0:
+            torch.set_num_threads(threads)
+        started = time.perf_counter()
+        self.tokenizer = AutoTokenizer.from_pretrained(model_id, padding_side="left")
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        model = AutoModelForCausalLM.from_pretrained(model_id, torch_dtype=torch.float32)
+        model.eval()
+        if quantize:
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.model = model
+        self.model_id = model_id
+        # Gemma ends a reply with <end_of_turn> before (or instead of) EOS
+        eos = self.tokenizer.eos_token_id
+        self.stop_ids = set(eos) if isinstance(eos, list) else {eos}
+        end_of_turn = self.tokenizer.convert_tokens_to_ids("<end_of_turn>")
+        if isinstance(end_of_turn, int) and end_of_turn != self.tokenizer.unk_token_id:
+            self.stop_ids.add(end_of_turn)
+        self.end_of_turn = end_of_turn if end_of_turn in self.stop_ids else None
+        self.prefix_cache = PrefixCache(prefix_cache_tokens) if prefix_cache_tokens > 0 else None
+        logger.info("local model %s loaded in %.1fs (int8=%s, threads=%d)",
+                    model_id, time.perf_counter() - started, quantize, torch.get_num_threads())
+
+    def prompt(self, messages: List[BaseMessage]) -> str:
+        return self.tokenizer.apply_chat_template(to_chat_turns(messages), tokenize=False, add_generation_prompt=True)
+
+    def generate(self, prompts: List[str], max_new_tokens: int, temperature: float, streamer: "BatchStreamer") -> None:
+        inputs = self.tokenizer(prompts, return_tensors="pt", padding=True, add_special_tokens=False)
+        streamer.prompt_lengths = inputs["attention_mask"].sum(dim=1).tolist()
+        streamer.cached_lengths = [0] * len(prompts)
+        sampling = {"do_sample": True, "temperature": temperature} if temperature > 0 else {"do_sample": False}
+        tokens = inputs["input_ids"][0].tolist()
+        if self.prefix_cache is not None and len(prompts) == 1:
+            sampling["past_key_values"], streamer.cached_lengths[0] = self._resume(tokens)
+        with self.torch.inference_mode():
+            self.model.generate(
+                **inputs,
+                max_new_tokens=max_new_tokens,
+                pad_token_id=self.tokenizer.pad_token_id,
+                streamer=streamer,
+                **sampling,
+            )
+        if "past_key_values" in sampling:
+            self._remember(tokens, sampling["past_key_values"])
+
+    def _resume(self, tokens: List[int]) -> Tuple[Any, int]:
+        # A private copy of the longest cached prefix (generate() extends the
+        # cache it is given in place), or a fresh cache to fill
+        from transformers import DynamicCache
+
+        matched, state = self.prefix_cache.lookup(tokens)
+        if state is None:
+            return DynamicCache(), 0
+        return copy.deepcopy(state), matched
+
+    def _remember(self, tokens: List[int], cache: Any) -> None:
+        # Keep this prompt's KV state for the session's next call and, the first
+        # time it is seen, the shared first turn (the stage system prompt)
+        try:
+            if self.end_of_turn in tokens:
+                shared = self.prefix_cache.usable_length(tokens.index(self.end_of_turn) + 2)
+                if shared and not self.prefix_cache.contains(tokens[:shared]):
+                    system_state = copy.deepcopy(cache)
+                    system_state.crop(shared)
+                    self.prefix_cache.store(tokens[:shared], system_state)
+            length = self.prefix_cache.usable_length(len(tokens))
+            cache.crop(length)
+            self.prefix_cache.store(tokens[:length], cache)
+        except Exception:
+            # A model whose cache cannot be cropped: run without prefix reuse
+            logger.warning("local prefix cache disabled for %s", self.model_id, exc_info=True)
+            self.prefix_cache = None
+
+
+class _Request:
+    __slots__ = ("prompt", "max_new_tokens", "temperature", "queue", "enqueued")
+
+    def __init__(self, prompt: str, max_new_tokens: int, temperature: float):
+        self.prompt = prompt
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.queue: "asyncio.Queue[Optional[Tuple[str, Any]]]" = asyncio.Queue()
+        self.enqueued = time.perf_counter()
+
+
+class BatchStreamer:
+    # transformers streamer for a whole batch: generate() calls put() with the
+    # prompt ids once, then with one new token id per row at every decoding step.
+    # Each row's text is decoded incrementally and handed to `deliver(row, item)`
+    # (from the model thread); finished rows are skipped.
+    def __init__(self, engine: LocalEngine, requests: List[_Request], deliver: Callable[[int, Any], None]):
+        self.engine = engine
+        self.requests = requests
+        self._send = deliver
+        self.prompt_lengths: List[int] = []
+        self.cached_lengths: List[int] = []
+        self.tokens: List[List[int]] = [[] for _ in requests]
+        self.sent = [0] * len(requests)
+        self.finished = [False] * len(requests)
+        self.prompt_seen = False
+
+    def _finish(self, row: int) -> None:
+        if not self.finished[row]:
+            self.finished[row] = True
+            usage = {
+                "input_tokens": self.prompt_lengths[row],
+                "output_tokens": len(self.tokens[row]),
+                "input_token_details": {"cache_read": self.cached_lengths[row]},
+            }
+            self._send(row, ("usage", usage))
+            self._send(row, None)
+
+    def put(self, value: Any) -> None:
+        if not self.prompt_seen:
+            self.prompt_seen = True
+            return
+        for row, token in enumerate(value.reshape(-1).tolist()):
+            if self.finished[row]:
+                continue
+            if token in self.engine.stop_ids:
+                self._finish(row)
+                continue
+            self.tokens[row].append(token)
+            text = self.engine.tokenizer.decode(self.tokens[row], skip_special_tokens=True)
+            if len(text) > self.sent[row] and not text.endswith("�"): # wait for complete characters
+                self._send(row, ("text", text[self.sent[row]:]))
+                self.sent[row] = len(text)
+            if len(self.tokens[row]) >= self.requests[row].max_new_tokens:
+                self._finish(row)
+
+    def end(self) -> None:
+        for row in range(len(self.requests)):
+            self._finish(row)
+
+    def fail(self, error: BaseException) -> None:
+        for row in range(len(self.requests)):
+            if not self.finished[row]:
+                self.finished[row] = True
+                self._send(row, ("error", error))
+                self._send(row, None)
+
+
+class BatchScheduler:
+    # Cross-session batching in front of a LocalEngine. One batch runs at a
+    # time on a dedicated thread (the model already uses every core it is given);
+    # requests arriving meanwhile queue up for the next batch.
+    def __init__(self, engine: LocalEngine, max_batch: int = 8, max_wait: float = 0.02):
+        self.engine = engine
+        self.max_batch = max(max_batch, 1)
+        self.max_wait = max_wait
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="local-llm")
+        self._pending: Optional["asyncio.Queue[_Request]"] = None
+        self._worker: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.batched_requests = 0
+
+    def _ensure_worker(self) -> "asyncio.Queue[_Request]":
+        # Created on first use, on the loop that serves requests
+        if self._worker is None or self._worker.done():
+            self._pending = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+        return self._pending
+
+    async def _collect(self, pending: "asyncio.Queue[_Request]") -> List[_Request]:
+        batch = [await pending.get()]
+        deadline = batch[0].enqueued + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                while len(batch) < self.max_batch and not pending.empty():
+                    batch.append(pending.get_nowait())
+                break
+            try:
+                batch.append(await asyncio.wait_for(pending.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        pending = self._pending
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect(pending)
+            # One sampling setting per forward pass: requests are grouped by
+            # temperature, the rest go back to the queue for the next batch
+            batch_temperature = batch[0].temperature
+            for request in [r for r in batch if r.temperature != batch_temperature]:
+                batch.remove(request)
+                pending.put_nowait(request)
+            streamer = BatchStreamer(
+                self.engine, batch,
+                lambda row, item, batch=batch: loop.call_soon_threadsafe(batch[row].queue.put_nowait, item)
+            )
+            self.batches += 1
+            self.batched_requests += len(batch)
+            logger.debug("local batch of %d (queued %d)", len(batch), pending.qsize())
+            try:
+                await loop.run_in_executor(
+                    self._executor,
+                    self.engine.generate,
+                    [r.prompt for r in batch],
+                    max(r.max_new_tokens for r in batch),
+                    batch_temperature,
+                    streamer,
+                )
+            except Exception as e:
+                logger.exception("local batch failed")
+                streamer.fail(e)
+            else:
+                streamer.end()
+
+    async def stream(self, messages: List[BaseMessage], max_new_tokens: int, temperature: float) -> AsyncIterator[Tuple[str, Any]]:
+        # ("text", piece)* then ("usage", {...}); raises if the batch failed
+        request = _Request(self.engine.prompt(messages), max_new_tokens, temperature)
+        self._ensure_worker().put_nowait(request)
+        while True:
+            item = await request.queue.get()
+            if item is None:
+                return
+            if item[0] == "error":
+                raise item[1]
+            yield item
+
+    def generate_one(self, messages: List[BaseMessage], max_new_tokens: int, temperature: float) -> Tuple[str, Dict[str, int]]:
+        # Synchronous path for the CLI loops: a batch of one on the model thread
+        request = _Request(self.engine.prompt(messages), max_new_tokens, temperature)
+        collected: List[Tuple[str, Any]] = []
+        streamer = BatchStreamer(self.engine, [request], lambda row, item: item is not None and collected.append(item))
+        self._executor.submit(self.engine.generate, [request.prompt], max_new_tokens, temperature, streamer).result()
+        streamer.end()
+        error = next((value for kind, value in collected if kind == "error"), None)
+        if error is not None:
+            raise error
+        text = "".join(value for kind, value in collected if kind == "text")
+        usage = next((value for kind, value in collected if kind == "usage"), {})
+        return text, usage
+
+
+def _usage_metadata(usage: Dict[str, int]) -> Optional[Dict[str, int]]:
+    if not usage:
+        return None
+    return {**usage, "total_tokens": usage["input_tokens"] + usage["output_tokens"]}
+
+
+class LocalChatModel(BaseChatModel):
+    model_id: str = "google/gemma-2-2b-it"
+    max_new_tokens: int = 256
+    temperature: float = 0.7
+    scheduler: Any = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "local-chat"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {
+            "model_id": self.model_id,
+            "max_new_tokens": self.max_new_tokens,
+            "temperature": self.temperature,
+        }
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        text, usage = self.scheduler.generate_one(messages, self.max_new_tokens, self.temperature)
+        message = AIMessage(content=text.strip(), usage_metadata=_usage_metadata(usage))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        pieces: List[str] = []
+        usage: Dict[str, int] = {}
+        async for kind, value in self.scheduler.stream(messages, self.max_new_tokens, self.temperature):
+            if kind == "text":
+                pieces.append(value)
+            else:
+                usage = value
+        message = AIMessage(content="".join(pieces).strip(), usage_metadata=_usage_metadata(usage))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        text, _ = self.scheduler.generate_one(messages, self.max_new_tokens, self.temperature)
+        yield ChatGenerationChunk(message=AIMessageChunk(content=text.strip()))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        async for kind, value in self.scheduler.stream(messages, self.max_new_tokens, self.temperature):
+            if kind != "text":
+                continue
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=value))
+            if run_manager:
+                await run_manager.on_llm_new_token(value, chunk=chunk)
+            yield chunk
+
@@ -1,18 +1,45 @@
-from fastapi import FastAPI, HTTPException
+import time
+_import_started = time.perf_counter() # startup budget: see report_startup below
+
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from typing import List, Dict, Any, Optional, AsyncIterator
+from collections import OrderedDict
 
-from langchain_huggingface import HuggingFaceEndpoint, ChatHuggingFace
-from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
-from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain_core.messages import SystemMessage
 from dotenv import load_dotenv
+from prompts import SYSTEM_PROMPTS
+from prompt_store import create_prompt_store, new_record
+from session_store import create_session_store
+from context import business_context, compact_history, count_tokens, transcript_tokens
+from candidates import CandidatesTimeout, best_of
+from finalize import (build_adapt_messages, build_final_messages, build_judge_messages, build_refine_messages, format_answers,
+                      format_history, refinement_text)
+from batch import parse_jsonl, run_batch
+from interview import InterviewComplete, create_interview_engine
+from llm_cache import create_llm_cache
+from admission import Overloaded, priority_for
+from models import ROLES, active_providers, get_router, preload
+from router import ProvidersUnavailable
+from semantic_index import create_semantic_index
+from speculation import Speculator
+from transcript import MAX_MESSAGE_CHARS, Transcript
+from telemetry import ADMISSION_QUEUE_DEPTH, ADMISSION_SHED, LIVE_SESSIONS, LLM_CACHE_LOOKUPS, SEMANTIC_LOOKUPS, SESSION_TRANSCRIPT_BYTES, SPECULATIONS, model_span, render_metrics
+import asyncio
+import copy
+import json
+import logging
 import os
 import uuid # To generate unique session IDs
 
 # Load environment variables
 load_dotenv()
 
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+logger = logging.getLogger("prompt_engine")
+
 app = FastAPI()
 
 # Configure CORS
@@ -29,100 +56,277 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize LLMs (these can be moved outside the request handling for efficiency if not already)
-# Ensure HF_API_TOKEN is set in your .env if the models require it or for rate limits
-llm1 = HuggingFaceEndpoint(
-    repo_id="google/gemma-2-2b-it",
-    task="text-generation",
-    # hf_token=os.getenv("HF_API_TOKEN")
-)
-llm2 = HuggingFaceEndpoint(
-    repo_id="google/gemma-2-2b-it",
-    task="text-generation",
-    # hf_token=os.getenv("HF_API_TOKEN")
-)
-llm3 = ChatGoogleGenerativeAI(
-    model="gemini-1.5-flash",
-    temperature=1,
-    max_tokens=500,
-    max_retries=2,
-    google_api_key=os.getenv("GOOGLE_API_KEY")
-)
+# Fire-and-forget work (indexing a finished prompt, warming the response cache).
+# The event loop only keeps weak references to tasks, so they are held here
+# until they finish.
+background_tasks: set = set()
+
+def spawn(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+# Models are built lazily by the registry (one client per distinct backend) and
+# addressed by role: "model1", "model2", "llm3". Calls go through the role's
+# router, which awaits the models' async interface so a slow upstream call never
+# blocks the event loop, caps in-flight calls per backend (HF_MAX_CONCURRENCY,
+# GEMINI_MAX_CONCURRENCY) and falls back to the role's other backends on failure.
+
+# Every real model call runs inside a telemetry span labelled with the
+# conversation stage ("greeting", "stage1_turn", "stage2_transition",
+# "stage2_turn", "finalize", "speculative_draft"/"speculative_refine"/
+# "finalize_refine" for the speculative finalize, "speculative_warm" for response cache warming,
+# "finalize_adapt" for near-duplicates, "*_candidate" and "finalize_judge" for
+# best-of-k and "regenerate" for stored prompts, see below), the backend and the
+# model id; see telemetry.py.
+
+def span_for(role: str, stage: str, session_id: Optional[str], messages):
+    # Opened before any client is built: the router fills in the backend and
+    # model that actually take the call (and falls back if one cannot be built)
+    return model_span(stage, ROLES[role][0], "", session_id, count_tokens(messages))
+
+async def ainvoke_limited(role: str, messages, stage: str, session_id: Optional[str] = None,
+                          info: Optional[Dict[str, Any]] = None):
+    # Wait for a free slot on the backend, then run the call without blocking the loop.
+    # `info`, when given, receives the backend and model that served the call.
+    async with span_for(role, stage, session_id, messages) as span:
+        response = await get_router(role).ainvoke(messages, span, priority_for(stage))
+        span.finish(response.content, getattr(response, "usage_metadata", None))
+        if info is not None:
+            info.update(backend=span.backend, model=span.model)
+        return response
+
+# Cache for replies to fixed inputs (greeting, stage-2 opener); None when LLM_CACHE=off
+llm_cache = create_llm_cache()
+
+async def warm_reply(role: str, messages: List[Any]) -> None:
+    # Pre-generate the cached replies for a fixed input. The calls go through
+    # the router like any other, in the "speculative" admission class.
+    await llm_cache.warm(ROLES[role], messages, lambda: ainvoke_limited(role, messages, "speculative_warm"))
+
+async def model_text(role: str, messages, stage: str, session_id: Optional[str] = None,
+                     stream: bool = False, cache: bool = False, info: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+    # Yields the reply token by token when streaming, or in a single piece otherwise.
+    # With cache=True the reply is looked up by (the role's backends, messages) first.
+    if cache and llm_cache is not None:
+        key = llm_cache.next_key(ROLES[role], messages)
+        text = await llm_cache.get(key)
+        if text is None:
+            pieces = []
+            async for piece in model_text(role, messages, stage, session_id, stream):
+                pieces.append(piece)
+                yield piece
+            text = "".join(pieces)
+            await llm_cache.put(key, text)
+        else:
+            yield text
+        return
+    if not stream:
+        response = await ainvoke_limited(role, messages, stage, session_id, info)
+        yield response.content
+        return
+    async with span_for(role, stage, session_id, messages) as span:
+        pieces = []
+        async for chunk in get_router(role).astream(messages, span, priority_for(stage)):
+            if chunk.content:
+                pieces.append(chunk.content)
+                yield chunk.content
+        span.finish("".join(pieces))
+        if info is not None:
+            info.update(backend=span.backend, model=span.model)
+
+# Upper bound on the (estimated) input tokens sent per model1/model2 call. The
+# full transcript stays in the session for LLM3; see context.compact_history.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+
+def call_messages(session_data: Dict[str, Any], chat_history: Transcript, stage: int) -> List[Any]:
+    # Compacted view of the conversation for the next interview call, with the
+    # per-call input token counts logged and accumulated on the session
+    messages, session_data["context_start"] = compact_history(
+        chat_history, stage, session_data.get("business_context"), CONTEXT_TOKEN_BUDGET, session_data.get("context_start", 0)
+    )
+    record_input_tokens(session_data, stage, count_tokens(messages), transcript_tokens(chat_history))
+    return messages
+
+def record_input_tokens(session_data: Dict[str, Any], stage: Any, sent: int, full: int) -> None:
+    usage = session_data.setdefault("input_tokens", {"sent": 0, "full": 0})
+    usage["sent"] += sent
+    usage["full"] += full
+    logger.info("model call stage=%s input_tokens=%d full_history_tokens=%d", stage, sent, full)
+
+# Stages, questions and transitions come from interview.py (INTERVIEW_MODE,
+# INTERVIEW_FILE); scripted questions are served without a model call
+interview = create_interview_engine()
+
+def stage_prompt(stage: int) -> str:
+    return SYSTEM_PROMPTS[interview.stage(stage)["system_prompt"]]
+
+# Session store: bounded in-memory LRU+TTL by default, or a SQLite/Redis store
+# shared by all workers (see session_store.create_session_store)
+sessions = create_session_store(SYSTEM_PROMPTS)
+
+# Speculation while the user is typing (SPECULATION=0 to disable):
+#   - once the last stage has at most SPECULATION_DRAFT_REMAINING questions
+#     left, LLM3 drafts the final prompt from the transcript so far, and each
+#     later answer is folded into that draft by a short refinement call (draft +
+#     new exchange) as it arrives; when the last answer arrives only one such
+#     refinement remains
+#   - in INTERVIEW_MODE=llm, the next stage's opener is generated into the
+#     response cache while its previous stage is on its last question
+# A draft is tagged with the number of answers it covers and is only used when
+# exactly the final answer is missing; such a draft that is still running is
+# awaited (within FINALIZE_DEADLINE_S), anything else is cancelled or dropped.
+SPECULATION = os.getenv("SPECULATION", "1") == "1"
+SPECULATION_DRAFT_REMAINING = int(os.getenv("SPECULATION_DRAFT_REMAINING", "1"))
+speculator = Speculator()
+
+def speculate(session_id: str, session_data: Dict[str, Any], chat_history: Transcript) -> None:
+    if not SPECULATION:
+        return
+    stage = session_data["stage"]
+    remaining = len(interview.stage(stage)["questions"]) - session_data["question_count"]
+    if stage < len(interview.stages):
+        if remaining == 1 and interview.mode == "llm" and llm_cache is not None:
+            following = interview.stage(stage + 1)
+            messages = [SystemMessage(content=stage_prompt(stage + 1))]
+            speculator.refresh(f"opener:stage{stage + 1}", lambda: warm_reply(following["role"], messages))
+        return
+    if remaining <= SPECULATION_DRAFT_REMAINING:
+        history = format_history(chat_history.to_messages())
+        exchange = format_history(chat_history.to_messages(-3, -1)) # last question and answer
+        snapshot = {"answers": dict(session_data["answers"])}
+        speculator.extend(
+            f"draft:{session_id}",
+            len(session_data["answers"]),
+            lambda draft: speculative_draft(session_id, snapshot, draft, history, exchange)
+        )
 
-# Wrap HuggingFace endpoints into chat models
-model1 = ChatHuggingFace(llm=llm1)
-model2 = ChatHuggingFace(llm=llm2)
-
-# System messages
-system_message_1 = """
-You are an experienced prompt engineer responsible for gathering specific information from users to pass along to your senior. Follow these guidelines carefully:
-Always begin the conversation with a friendly greeting. If the user greets you first, respond warmly with a greeting in return.
-Ask permission politely to move further to make prompt. Ask questions one at a time, ensuring clarity and focus in each step.
-If the user asks questions or requests help unrelated to prompt engineering—such as writing code, solving equations, or other topics—politely decline and explain that your expertise is focused solely on prompt engineering.
-In your initial message, start by stating "Level 1 Business Context" to set the conversation tone.
-Proceed to ask these questions sequentially:
-
-0. What is the industry you are in such as healthcare, e-commerce, SaaS?
-1. What is the name of your business?
-2. What products or services do you offer? Please describe them in detail.
-3. Target audience or what is the analysis you figure out?
-"""
-
-system_message_2 = """
-You are an experienced prompt engineer x2 responsible for gathering specific information from users to pass along to your senior. Follow these guidelines carefully your role is ask domain specific question to user from different perspective like from consumer, from investor, etc.:
-Always begin the conversation with a friendly greeting.
-Ask questions one at a time, ensuring clarity and focus in each step.
-If the user asks questions or requests help unrelated to prompt engineering—such as writing code, solving equations, or other topics—politely decline and explain that your expertise is focused solely on prompt engineering.
-In your initial message, start by stating "Level 2 Prompt Design" to set the conversation tone.
-Proceed to ask these questions sequentially:
-
-0. What is the purpose of the prompt?
-1. Make it more descriptive—how does your prompt help the business?
-2. Are you going to reuse it?
-3. What are the desired outputs? Examples: bullet points, short paragraph, long format, etc.
-4. Any specific format you need in the output?
-5. Can you give an example of how the prompt and user/business/client conversation should go?
-6. Do you need multi-step reasoning in the prompt?
-"""
-
-system_message_3 = """
-You are a highly experienced and advanced prompt engineer assigned a critical role in a team that designs precise and effective prompts for large language models (LLMs) to ensure optimal and contextually accurate responses. Your primary responsibility is to transform raw conversational data into a structured, detailed, and goal-oriented prompt that drives high-quality output from the LLM.
-
-In your role, you are not permitted to interact directly with users or ask question be remmember most important dont ever try make asumption if needed. Instead, your junior team members will provide you with a summarized or full record of the prior conversation between the user and the system, referred to as {chat_history}. This {chat_history} contains all the necessary context, including the user's goals, questions, follow-ups, and clarifications. You must rely solely on this data to craft a final prompt that aligns with the user's intent.
-
-Your job is to reconstruct the user's query and intent using a step-by-step, analytical approach, making the prompt logically structured, unambiguous, internally consistent, and effective in guiding the LLM to produce optimal results.
-
-Prompt Engineering Guidelines and Steps to Follow:
-Extract and Expand the User’s Chain of Thought (CoT):
-- Analyze the user's query in {chat_history}.
-- Break it down into components, sub-components, and nested ideas.
-- Reconstruct the logical flow to mirror the user’s thought process.
-- make a good long prompt dont make less prompt , like one or half page full descriptive so llm can understnad effecitively
-- When referring to chat history, specifically reference messages by their role (User, AI).
-
-Apply Bounded Assumptions:
-- Make domain-bounded assumptions where information is partial.
-- Do not guess beyond the scope of the context.
-
-Maintain Self-Consistency:
-- Track and preserve information from earlier messages.
-- Ensure modified requirements are integrated accurately.
-
-Eliminate Ambiguity:
-- Use specific, concrete phrasing.
-- Avoid vague pronouns or generalities unless clearly tied to context.
-
-Important Constraints:
-- Do not interact with users.
-- Do not hallucinate.
-- Produce a clear, self-contained final prompt that can be executed without clarification.
-"""
-
-# In-memory session store (for demonstration purposes)
-sessions: Dict[str, Dict[str, Any]] = {}
+async def speculative_draft(session_id: str, snapshot: Dict[str, Any], draft: Optional[str], history: str,
+                            exchange: str) -> Optional[str]:
+    # The previous draft with the latest exchange folded in, or a new draft
+    # from the whole transcript when there is none yet. No draft when a stored
+    # prompt is already close to these answers: the finalize step will reuse or
+    # adapt it instead of refining a draft
+    outcome, _ = await similar_prompt(snapshot, record=False)
+    if outcome != "miss":
+        return None
+    if draft is None:
+        return (await ainvoke_limited("llm3", build_final_messages(history), "speculative_draft", session_id)).content
+    response = await ainvoke_limited("llm3", build_refine_messages(draft, exchange), "speculative_refine", session_id)
+    return draft + refinement_text(response.content)
+
+# Near-duplicate finalize (SEMANTIC_INDEX=1, see semantic_index.py). Finished
+# prompts are indexed by the answers they were made from, leaving out the
+# business name. At finalize, the nearest stored prompt is
+#   - served as is when it is at least SEMANTIC_REUSE_THRESHOLD similar and was
+#     made for the same business name (a user redoing the interview), or
+#   - handed to LLM3 to adapt to this user's answers when it is at least
+#     SEMANTIC_ADAPT_THRESHOLD similar;
+# otherwise the prompt is generated from scratch. Another business's prompt is
+# never shown without the adapt step, since it carries that business's details.
+semantic_index = None # built at startup, see load_semantic_index
+SEMANTIC_REUSE_THRESHOLD = float(os.getenv("SEMANTIC_REUSE_THRESHOLD", "0.97"))
+SEMANTIC_ADAPT_THRESHOLD = float(os.getenv("SEMANTIC_ADAPT_THRESHOLD", "0.85"))
+SEMANTIC_SAVE_EVERY = int(os.getenv("SEMANTIC_SAVE_EVERY", "20")) # new prompts between saves
+
+def answer_pairs(session_data: Dict[str, Any]) -> List[Any]:
+    return [pair for number in range(1, len(interview.stages) + 1) for pair in interview.answer_pairs(session_data, number)]
+
+def answers_text(session_data: Dict[str, Any]) -> str:
+    answers = session_data["answers"]
+    return "\n".join(
+        f"{question.get('label', question['key'])}: {answers[question['key']]}"
+        for stage in interview.stages
+        for question in stage["questions"]
+        if question["key"] in answers and question["key"] != "business_name"
+    )
+
+async def similar_prompt(session_data: Dict[str, Any], record: bool = True) -> Any:
+    # ("reuse" | "adapt" | "miss", stored entry or None); `record` counts the
+    # outcome in the lookup metrics (the speculative lookup is not counted)
+    if semantic_index is None:
+        return "miss", None
+    found = await asyncio.to_thread(semantic_index.search, answers_text(session_data))
+    outcome, entry = "miss", None
+    if found is not None:
+        score, entry = found
+        business = session_data["answers"].get("business_name", "").strip().lower()
+        if score >= SEMANTIC_REUSE_THRESHOLD and business and entry["business"] == business:
+            outcome = "reuse"
+        elif score >= SEMANTIC_ADAPT_THRESHOLD:
+            outcome = "adapt"
+        logger.info("semantic lookup: nearest prompt %.3f similar -> %s", score, outcome)
+    if record:
+        semantic_index.lookups[outcome] += 1
+    return outcome, entry
+
+async def remember_prompt(session_data: Dict[str, Any], prompt: str, models: Dict[str, Any]) -> None:
+    entry = {"prompt": prompt, "business": session_data["answers"].get("business_name", "").strip().lower(), "models": models}
+    await asyncio.to_thread(semantic_index.add, answers_text(session_data), entry)
+    if semantic_index.dirty >= SEMANTIC_SAVE_EVERY:
+        await asyncio.to_thread(semantic_index.save)
+
+# Self-consistency finalize (FINALIZE_CANDIDATES > 1): that many LLM3
+# candidates run concurrently from the same messages; once the first is back the
+# others get FINALIZE_GRACE_RATIO of its time (never past FINALIZE_DEADLINE_S),
+# stragglers are cancelled and the best one is kept, picked by heuristics or by
+# one judge call (FINALIZE_JUDGE=1). The reply is sent in one piece. When no
+# candidate is back by the deadline the turn fails with 503 and a Retry-After
+# of FINALIZE_RETRY_AFTER_S; the answer can simply be sent again.
+FINALIZE_CANDIDATES = int(os.getenv("FINALIZE_CANDIDATES", "1"))
+FINALIZE_DEADLINE_S = float(os.getenv("FINALIZE_DEADLINE_S", "45"))
+FINALIZE_RETRY_AFTER_S = int(os.getenv("FINALIZE_RETRY_AFTER_S", "10"))
+FINALIZE_GRACE_RATIO = float(os.getenv("FINALIZE_GRACE_RATIO", "0.3"))
+FINALIZE_JUDGE = os.getenv("FINALIZE_JUDGE", "0") == "1"
+
+async def finalize_candidates(messages: List[Any], stage: str, session_data: Dict[str, Any], session_id: str,
+                              info: Dict[str, Any]) -> str:
+    # `info` receives the backend and model of the candidate that was kept
+    infos: List[Dict[str, Any]] = [{} for _ in range(FINALIZE_CANDIDATES)]
+
+    async def generate(i: int) -> str:
+        response = await ainvoke_limited("llm3", messages, stage if i == 0 else f"{stage}_candidate", session_id, infos[i])
+        return response.content
+
+    async def judge(candidates: List[str]) -> str:
+        judge_messages = build_judge_messages(candidates, format_answers(answer_pairs(session_data)))
+        return (await ainvoke_limited("llm3", judge_messages, "finalize_judge", session_id)).content
+
+    text, summary = await best_of(
+        generate,
+        FINALIZE_CANDIDATES,
+        list(session_data["answers"].values()),
+        FINALIZE_DEADLINE_S,
+        FINALIZE_GRACE_RATIO,
+        judge if FINALIZE_JUDGE else None,
+    )
+    logger.info("finalize candidates (session %s): %s", session_id, summary)
+    info.update(infos[summary["picked"]])
+    return text
+
+# Finished prompts are kept in a durable, append-only store (see prompt_store.py)
+# and can be listed, searched, fetched and regenerated through /prompts
+prompt_store = create_prompt_store()
+
+def store_prompt(session_data: Dict[str, Any], session_id: Optional[str], prompt: str, source: str,
+                 models: Dict[str, Any], finalize_seconds: Optional[float]) -> Optional[str]:
+    # Queues the prompt for the background writer; returns its id
+    if prompt_store is None:
+        return None
+    started_at = session_data.get("started_at")
+    record = new_record(
+        session_id, dict(session_data["answers"]), prompt, source, models,
+        finalize_seconds=finalize_seconds,
+        session_seconds=round(time.time() - started_at, 3) if started_at else None,
+    )
+    prompt_store.add(record)
+    return record["id"]
 
 class GenerateRequest(BaseModel):
-    useCase: str
+    # Answers are capped here, once, so the session, the stores and every model
+    # call see the same text (see transcript.py)
+    useCase: str = Field(..., max_length=MAX_MESSAGE_CHARS)
     session_id: Optional[str] = None
 
 class GenerateResponse(BaseModel):
@@ -130,179 +334,655 @@ class GenerateResponse(BaseModel):
     session_id: str
     status: str
     is_final_prompt: bool = False
+    prompt_id: Optional[str] = None # id in the prompt store, for the final prompt
+
+def new_session_state() -> Dict[str, Any]:
+    state = interview.new_state() # stage, question_count, answers, clarifications
+    state.update({
+        # Start with the system message for stage 1
+        "chat_history": Transcript(),
+        "started_at": time.time()
+    })
+    state["chat_history"].add_system(stage_prompt(1))
+    return state
+
+def unavailable_error(e: ProvidersUnavailable) -> HTTPException:
+    # Every provider for the stage is down or rate limited: ask the client to
+    # retry later instead of reporting an internal error
+    return HTTPException(
+        status_code=503,
+        detail=f"The AI service is temporarily unavailable: {e}",
+        headers={"Retry-After": str(int(e.retry_after + 0.999))}
+    )
+
+def finalize_timeout_error(e: CandidatesTimeout) -> HTTPException:
+    # Every finalize candidate overran its deadline: a temporary condition, so
+    # the client retries instead of seeing an internal error
+    return HTTPException(
+        status_code=503,
+        detail=f"Generating the final prompt took too long, please retry shortly: {e}",
+        headers={"Retry-After": str(FINALIZE_RETRY_AFTER_S)}
+    )
+
+def overloaded_error(e: Overloaded) -> HTTPException:
+    # Shed by admission control (queue full or waited past its deadline): the
+    # client should back off and retry, it is not a server error
+    return HTTPException(
+        status_code=429,
+        detail=f"The service is busy, please retry shortly: {e}",
+        headers={"Retry-After": str(int(e.retry_after + 0.999))}
+    )
+
+def error_event(e: HTTPException) -> Dict[str, Any]:
+    # In-band error for a response that has already started
+    error = {"event": "error", "status": e.status_code, "detail": e.detail}
+    if e.headers and "Retry-After" in e.headers:
+        error["retry_after"] = int(e.headers["Retry-After"])
+    return error
+
+def done_event(prompt: str, session_id: str, status: str = "continue", is_final_prompt: bool = False,
+               prompt_id: Optional[str] = None) -> Dict[str, Any]:
+    return {
+        "event": "done",
+        "prompt": prompt,
+        "session_id": session_id,
+        "status": status,
+        "is_final_prompt": is_final_prompt,
+        "prompt_id": prompt_id
+    }
 
-@app.post("/generate", response_model=GenerateResponse)
-async def generate_prompt(request: GenerateRequest):
-    session_id = request.session_id
-    user_input = request.useCase
-
-    if not session_id or session_id not in sessions:
+async def step_text(step, session_data: Dict[str, Any], chat_history: Transcript, span_stage: str,
+                    session_id: str, stream: bool) -> AsyncIterator[str]:
+    # The AI side of an interview step: the scripted text itself, or a model call
+    if step.kind == "ask":
+        yield step.text
+        return
+    if step.cache:
+        # Free-form stage opener: only depends on the stage system prompt, so it
+        # is served from the response cache
+        messages = [SystemMessage(content=stage_prompt(step.stage))]
+        record_input_tokens(session_data, step.stage, count_tokens(messages), transcript_tokens(chat_history))
+    else:
+        messages = call_messages(session_data, chat_history, step.stage)
+        if step.hint:
+            messages.append(SystemMessage(content=step.hint))
+    async for token in model_text(step.role, messages, span_stage, session_id, stream, cache=step.cache):
+        yield token
+
+async def start_session(session_id: str, stream: bool = False) -> AsyncIterator[Dict[str, Any]]:
+    # Create the session and send the opening greeting with the first question
+    session_data = new_session_state()
+    chat_history = session_data["chat_history"]
+    yield {"event": "session", "session_id": session_id}
+
+    greeting = []
+    async for token in step_text(interview.start(session_data), session_data, chat_history, "greeting", session_id, stream):
+        greeting.append(token)
+        if stream:
+            yield {"event": "token", "text": token}
+    content = "".join(greeting)
+    chat_history.add_ai(content)
+    await sessions.put(session_id, session_data)
+    yield done_event(content, session_id)
+
+def turn_checkpoint(session_data: Dict[str, Any]) -> Dict[str, Any]:
+    # Everything a turn may change: the interview state and the transcript length
+    checkpoint = {key: copy.deepcopy(value) for key, value in session_data.items() if key != "chat_history"}
+    checkpoint["chat_history"] = len(session_data["chat_history"])
+    return checkpoint
+
+def rollback_turn(session_data: Dict[str, Any], checkpoint: Dict[str, Any]) -> None:
+    # The memory store hands out the stored dict itself, so a failed turn must
+    # not leave a half-recorded answer behind
+    session_data["chat_history"].truncate(checkpoint["chat_history"])
+    for key in [key for key in session_data if key not in checkpoint]:
+        del session_data[key]
+    session_data.update({key: value for key, value in checkpoint.items() if key != "chat_history"})
+
+# Sessions with a turn in progress in this worker. A second turn for the same
+# session gets 409 (as on the WebSocket) instead of interleaving with the first,
+# since both would record answers into the same state.
+active_turns: set = set()
+
+def turn_in_progress_error() -> HTTPException:
+    return HTTPException(status_code=409, detail="A turn is already in progress for this session")
+
+async def run_turn(session_id: Optional[str], user_input: str, stream: bool = False) -> AsyncIterator[Dict[str, Any]]:
+    # One conversation turn as a sequence of events: "session" first, then
+    # "banner"/"stage"/"token" events while the reply is produced, and a final "done"
+    # event carrying the same fields as GenerateResponse. The session/stage
+    # bookkeeping is identical whether or not the tokens are streamed.
+    if session_id in active_turns:
+        raise turn_in_progress_error()
+    session_data = await sessions.get(session_id) if session_id else None
+    if session_data is None:
         # New session or invalid session_id, initialize
         session_id = str(uuid.uuid4())
-        sessions[session_id] = {
-            # Start with the system message for stage 1
-            "chat_history": [SystemMessage(content=system_message_1)],
-            "stage": 1,
-            "question_count": 0,
-            "messages_sent_to_frontend": [] # To track messages already sent
-        }
-        
-        # Get initial greeting from model1
         try:
-            initial_response = model1.invoke(sessions[session_id]["chat_history"])
-            sessions[session_id]["chat_history"].append(AIMessage(content=initial_response.content))
-            return GenerateResponse(
-                prompt=initial_response.content,
-                session_id=session_id,
-                status="continue",
-                is_final_prompt=False
-            )
+            async for event in start_session(session_id, stream):
+                yield event
+        except ProvidersUnavailable as e:
+            raise unavailable_error(e)
+        except Overloaded as e:
+            raise overloaded_error(e)
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Failed to start conversation: {e}")
+        return
+
+    if session_id in active_turns:
+        raise turn_in_progress_error() # another turn started while the session loaded
+    active_turns.add(session_id)
+    try:
+        async for event in session_turn(session_id, session_data, user_input, stream):
+            yield event
+    finally:
+        active_turns.discard(session_id)
+
+async def session_turn(session_id: str, session_data: Dict[str, Any], user_input: str,
+                       stream: bool) -> AsyncIterator[Dict[str, Any]]:
+    yield {"event": "session", "session_id": session_id}
 
-    session_data = sessions[session_id]
     chat_history = session_data["chat_history"]
-    stage = session_data["stage"]
-    question_count = session_data["question_count"]
+    # Undo the turn's changes if it fails or the client goes away before it is
+    # recorded, so the client can simply send the same answer again
+    checkpoint = turn_checkpoint(session_data)
+    completed = False
 
+    if not chat_history.fits(user_input):
+        raise HTTPException(status_code=413, detail="This conversation has reached its size limit")
     # Append user's latest message to the *current* chat history
-    chat_history.append(HumanMessage(content=user_input))
+    chat_history.add_user(user_input)
 
     try:
-        if stage == 1:
-            question_count += 1
-            response = model1.invoke(chat_history)
-            chat_history.append(AIMessage(content=response.content))
-            
-            if question_count >= 4: # Based on system message 1 having 4 questions (0-3)
-                # Transition to stage 2
-                stage = 2
-                question_count = 0 # Reset question count for the new stage
-                
-                # Append the system message for stage 2 to the *existing* chat history
-                chat_history.append(SystemMessage(content=system_message_2))
-                
-                # Get initial greeting/question for stage 2 from model2
-                # Pass the full chat_history (including stage 1 and stage 2 system message) to model2
-                response_content = model2.invoke(chat_history).content
-                chat_history.append(AIMessage(content=response_content))
-                
-                session_data.update({
-                    "stage": stage,
-                    "question_count": question_count,
-                    "chat_history": chat_history
-                })
-                return GenerateResponse(
-                    prompt=f"Switching to Level 2 Prompt Design...\n{response_content}",
-                    session_id=session_id,
-                    status="continue",
-                    is_final_prompt=False
-                )
-            
-            session_data.update({
-                "question_count": question_count,
-                "chat_history": chat_history
-            })
-            return GenerateResponse(
-                prompt=response.content,
-                session_id=session_id,
-                status="continue",
-                is_final_prompt=False
+        # The interview engine records the answer and decides the next step:
+        # a scripted question (no model call), a model call to clarify or
+        # rephrase, a stage transition, or the final LLM3 step
+        step = interview.answer(session_data, user_input)
+        if step.banner:
+            # Sent before any model call so the client can show progress at once
+            yield {"event": "banner", "text": step.banner}
+        if step.transition:
+            yield {"event": "stage", "stage": step.stage, "title": interview.stage(step.stage).get("title")}
+        elif step.kind == "finalize":
+            yield {"event": "stage", "stage": "finalize", "title": None}
+
+        if step.kind == "finalize":
+            # Prepare the chat history for LLM3: the transcript is formatted as
+            # text and embedded in system_message_3 (see finalize.py)
+            final_prompt_messages = build_final_messages(format_history(chat_history.to_messages()))
+            final_tokens = count_tokens(final_prompt_messages)
+            span_stage = "finalize"
+
+            # With a speculative draft covering every answer but this one, only
+            # the refinement with the latest exchange is left to do; otherwise a
+            # near-duplicate prompt may be reused or adapted (the draft is not
+            # made when the lookup already matched without the last answer)
+            draft = await speculator.take(f"draft:{session_id}", len(session_data["answers"]) - 1, FINALIZE_DEADLINE_S)
+            outcome, similar = ("miss", None) if draft is not None else await similar_prompt(session_data)
+            if draft is not None:
+                final_prompt_messages = build_refine_messages(draft, format_history(chat_history.to_messages(-2)))
+                span_stage = "finalize_refine"
+            elif outcome == "adapt":
+                final_prompt_messages = build_adapt_messages(similar["prompt"], format_answers(answer_pairs(session_data)))
+                span_stage = "finalize_adapt"
+
+            final = []
+            info: Dict[str, Any] = {}
+            finalize_started = time.perf_counter()
+            if outcome == "reuse":
+                final.append(similar["prompt"])
+                if stream:
+                    yield {"event": "token", "text": similar["prompt"]}
+            elif draft is not None:
+                # The draft goes out at once; the refinement only adds the
+                # section for the last answer
+                record_input_tokens(session_data, 3, count_tokens(final_prompt_messages), final_tokens)
+                final.append(draft)
+                if stream:
+                    yield {"event": "token", "text": draft}
+                response = await ainvoke_limited("llm3", final_prompt_messages, span_stage, session_id, info)
+                addition = refinement_text(response.content)
+                if addition:
+                    final.append(addition)
+                    if stream:
+                        yield {"event": "token", "text": addition}
+            else:
+                record_input_tokens(session_data, 3, count_tokens(final_prompt_messages), final_tokens)
+                if FINALIZE_CANDIDATES > 1:
+                    final.append(await finalize_candidates(final_prompt_messages, span_stage, session_data, session_id, info))
+                    if stream:
+                        yield {"event": "token", "text": final[0]}
+                else:
+                    async for token in model_text("llm3", final_prompt_messages, span_stage, session_id, stream, info=info):
+                        final.append(token)
+                        if stream:
+                            yield {"event": "token", "text": token}
+
+            source = "reuse" if outcome == "reuse" else span_stage
+            models = similar.get("models", {}) if outcome == "reuse" else {"llm3": info.get("model"), "llm3_backend": info.get("backend")}
+            prompt_id = store_prompt(
+                session_data, session_id, "".join(final), source, models, round(time.perf_counter() - finalize_started, 3)
             )
-
-        elif stage == 2:
-            question_count += 1
-            response = model2.invoke(chat_history)
-            chat_history.append(AIMessage(content=response.content))
-            
-            if question_count >= 7: # Based on system message 2 having 7 questions (0-6)
-                # Finalize prompt using advanced engineer (LLM3)
-                
-                # Prepare the full chat history for LLM3, including the system message for LLM3
-                # We want to format the chat history for the system prompt.
-                # A common approach is to format it as a string within the system prompt.
-                
-                # Format the existing chat history (excluding the stage system messages that are not meant for LLM3 to "talk" to)
-                formatted_history = []
-                for msg in chat_history:
-                    if isinstance(msg, HumanMessage):
-                        formatted_history.append(f"User: {msg.content}")
-                    elif isinstance(msg, AIMessage):
-                        formatted_history.append(f"AI: {msg.content}")
-                
-                # Create the final system message with the embedded chat history
-                final_system_message_content = system_message_3.format(
-                    chat_history="\n".join(formatted_history)
-                )
-                
-                # The messages passed to LLM3 should primarily be the instruction for LLM3 itself
-                # and then a single "HumanMessage" that LLM3 is supposed to respond to, containing the context.
-                # Here, we're making the entire instruction and context part of the system message,
-                # then giving a blank human message to trigger the response.
-                
-                # Alternatively, you could pass the entire `chat_history` list directly to `llm3.invoke`
-                # if `llm3` is designed to interpret a list of LangChain Message objects.
-                # Given system_message_3 expects {chat_history} as a string, this formatting is better.
-
-                final_prompt_messages = [
-                    SystemMessage(content=final_system_message_content),
-                    HumanMessage(content="Please generate the final comprehensive prompt based on the provided chat history.")
-                ]
-                
-                final_response = llm3.invoke(final_prompt_messages)
-                
-                # Append final AI response to chat history for completeness (optional, as session is deleted)
-                # chat_history.append(AIMessage(content=final_response.content))
-                
-                # Clear session data after final prompt
-                del sessions[session_id]
-                
-                return GenerateResponse(
-                    prompt=f"Finalizing prompt using advanced engineer (LLM3)...\n{final_response.content}",
-                    session_id=session_id,
-                    status="completed",
-                    is_final_prompt=True
-                )
-            
-            session_data.update({
-                "question_count": question_count,
-                "chat_history": chat_history
-            })
-            return GenerateResponse(
-                prompt=response.content,
-                session_id=session_id,
-                status="continue",
-                is_final_prompt=False
+            if semantic_index is not None and outcome != "reuse":
+                spawn(remember_prompt(session_data, "".join(final), models))
+
+            # Clear session data after final prompt
+            await sessions.delete(session_id)
+            completed = True
+
+            yield done_event(
+                f"{step.banner}\n{''.join(final)}",
+                session_id,
+                status="completed",
+                is_final_prompt=True,
+                prompt_id=prompt_id
             )
-
+            return
+
+        if step.transition:
+            # Collapse the answers of every finished stage into a compact record
+            # that replaces their transcript in every later call, and append the
+            # next stage's system message to the *existing* chat history
+            finished = [pair for number in range(1, step.stage) for pair in interview.answer_pairs(session_data, number)]
+            session_data["business_context"] = business_context(finished, step.stage - 1)
+            chat_history.add_system(stage_prompt(step.stage))
+
+        span_stage = f"stage{step.stage}_transition" if step.transition else f"stage{step.stage}_turn"
+        reply = []
+        async for token in step_text(step, session_data, chat_history, span_stage, session_id, stream):
+            reply.append(token)
+            if stream:
+                yield {"event": "token", "text": token}
+        content = "".join(reply)
+        chat_history.add_ai(content)
+
+        await sessions.put(session_id, session_data)
+        completed = True
+        speculate(session_id, session_data, chat_history)
+        yield done_event(f"{step.banner}\n{content}" if step.banner else content, session_id)
+
+    except ProvidersUnavailable as e:
+        rollback_turn(session_data, checkpoint)
+        speculator.discard(f"draft:{session_id}")
+        logger.warning("Providers unavailable (session %s): %s", session_id, e)
+        raise unavailable_error(e)
+    except Overloaded as e:
+        rollback_turn(session_data, checkpoint)
+        logger.warning("Model call shed (session %s): %s", session_id, e)
+        raise overloaded_error(e)
+    except CandidatesTimeout as e:
+        rollback_turn(session_data, checkpoint)
+        logger.warning("Finalize timed out (session %s): %s", session_id, e)
+        raise finalize_timeout_error(e)
+    except InterviewComplete:
+        rollback_turn(session_data, checkpoint)
+        raise HTTPException(status_code=409, detail="This session's final prompt is already being generated")
     except Exception as e:
-        print(f"Error during prompt generation: {e}")
+        rollback_turn(session_data, checkpoint)
+        logger.exception("Error during prompt generation (session %s)", session_id)
         raise HTTPException(status_code=500, detail=f"An error occurred during AI processing: {e}")
+    except BaseException:
+        # Cancelled, e.g. a /generate/stream client disconnected mid-turn
+        if not completed:
+            rollback_turn(session_data, checkpoint)
+        raise
+
+async def collect_turn(events: AsyncIterator[Dict[str, Any]]) -> GenerateResponse:
+    # Drain a turn and keep only its final "done" event
+    result = None
+    async for event in events:
+        if event["event"] == "done":
+            result = event
+    return GenerateResponse(**{k: v for k, v in result.items() if k != "event"})
+
+async def ndjson_stream(events: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[str]:
+    # One JSON object per line; failures after the response has started are
+    # reported in-band since the status code is already sent
+    try:
+        async for event in events:
+            yield json.dumps(event) + "\n"
+    except HTTPException as e:
+        yield json.dumps(error_event(e)) + "\n"
+
+@app.on_event("startup")
+async def report_startup():
+    logger.info("startup: module import took %.3fs", IMPORT_SECONDS)
+    # Build the model clients in a worker thread so the port is bound first
+    # and the first request does not pay for it (MODELS_PRELOAD=0 to disable)
+    if os.getenv("MODELS_PRELOAD", "1") == "1":
+        global preload_task
+        preload_task = asyncio.create_task(preload_models())
+
+preload_task: Optional[asyncio.Task] = None
+
+async def preload_models():
+    started = time.perf_counter()
+    errors = await asyncio.to_thread(preload)
+    for name, error in errors.items():
+        logger.error("startup: building model backend %s failed: %r", name, error)
+    logger.info("startup: model backends built in %.3fs", time.perf_counter() - started)
+
+class FirstRequestReporter:
+    # Logs when the first request has been served; a plain ASGI wrapper, so
+    # later requests only pay for one attribute check
+    def __init__(self, app):
+        self.app = app
+        self.logged = False
+
+    async def __call__(self, scope, receive, send):
+        await self.app(scope, receive, send)
+        if not self.logged and scope["type"] == "http":
+            self.logged = True
+            logger.info("startup: first request served %.3fs after import began", time.perf_counter() - _import_started)
+
+app.add_middleware(FirstRequestReporter)
+
+@app.on_event("startup")
+async def warm_llm_cache():
+    # Optionally pre-generate the greeting pool and the stage-2 openers so the
+    # first users are served from the cache as well (GREETING_POOL_WARM=1)
+    # Only free-form (INTERVIEW_MODE=llm) sessions ask the models for openers
+    if llm_cache is None or interview.mode != "llm" or os.getenv("GREETING_POOL_WARM", "0") != "1":
+        return
+    for number, stage in enumerate(interview.stages, start=1):
+        spawn(warm_reply(stage["role"], [SystemMessage(content=stage_prompt(number))]))
+
+@app.on_event("shutdown")
+async def flush_prompt_store():
+    if prompt_store is not None:
+        await prompt_store.flush()
+
+@app.on_event("startup")
+async def load_semantic_index():
+    # Off the import path and the event loop: the embedding model may take a
+    # while to load (or download); until it is ready every lookup is a miss
+    global semantic_index
+    try:
+        semantic_index = await asyncio.to_thread(create_semantic_index)
+    except Exception:
+        logger.exception("semantic index unavailable, near-duplicate lookups are off")
+
+@app.on_event("shutdown")
+async def save_semantic_index():
+    if semantic_index is not None and semantic_index.dirty:
+        await asyncio.to_thread(semantic_index.save)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    # Prometheus text exposition: per-stage model spans, in-flight calls,
+    # live sessions and their transcript memory, admission queues, response
+    # cache lookups, speculation and near-duplicate outcomes
+    LIVE_SESSIONS.set((), await sessions.size())
+    if llm_cache is not None:
+        LLM_CACHE_LOOKUPS.set(("hit",), llm_cache.hits)
+        LLM_CACHE_LOOKUPS.set(("miss",), llm_cache.misses)
+    if semantic_index is not None:
+        for outcome, count in semantic_index.lookups.items():
+            SEMANTIC_LOOKUPS.set((outcome,), count)
+    for provider in active_providers():
+        for priority, depth in provider.gate.depth().items():
+            ADMISSION_QUEUE_DEPTH.set((provider.name, priority), depth)
+        for (priority, reason), count in provider.gate.shed.items():
+            ADMISSION_SHED.set((provider.name, priority, reason), count)
+    sizes = sessions.transcript_bytes()
+    if sizes is not None:
+        SESSION_TRANSCRIPT_BYTES.set(("total",), sum(sizes))
+        SESSION_TRANSCRIPT_BYTES.set(("per_session",), sum(sizes) / len(sizes) if sizes else 0)
+        SESSION_TRANSCRIPT_BYTES.set(("max",), max(sizes, default=0))
+    SPECULATIONS.set(("started",), speculator.started)
+    SPECULATIONS.set(("used",), speculator.used)
+    SPECULATIONS.set(("discarded",), speculator.discarded)
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.post("/generate", response_model=GenerateResponse)
+async def generate_prompt(request: GenerateRequest):
+    return await collect_turn(run_turn(request.session_id, request.useCase))
+
+@app.post("/generate/stream")
+async def generate_prompt_stream(request: GenerateRequest):
+    # Same conversation flow as /generate, but tokens from model1, model2 and
+    # llm3 are sent as NDJSON events as soon as they arrive
+    return StreamingResponse(
+        ndjson_stream(run_turn(request.session_id, request.useCase, stream=True)),
+        media_type="application/x-ndjson"
+    )
+
+# Batch generation skips the interview: one LLM3 call per pre-filled record
+BATCH_MAX_WORKERS = int(os.getenv("BATCH_MAX_WORKERS", "8"))
+BATCH_RATE_PER_MINUTE = float(os.getenv("BATCH_RATE_PER_MINUTE", "0")) # 0 = unlimited
+
+@app.post("/batch")
+async def batch_generate(request: Request, workers: int = 4):
+    # Body: JSONL of pre-filled question/answer records (see batch.py). Results
+    # stream back as NDJSON in completion order; a client resumes an interrupted
+    # batch by resending only the records whose ids it has not received.
+    try:
+        records = parse_jsonl((await request.body()).decode("utf-8").splitlines())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid JSONL: {e}")
+
+    async def invoke(messages):
+        return await ainvoke_limited("llm3", messages, "batch_finalize")
+
+    results = run_batch(records, invoke, min(max(workers, 1), BATCH_MAX_WORKERS), BATCH_RATE_PER_MINUTE)
+    return StreamingResponse(
+        (json.dumps(result) + "\n" async for result in results),
+        media_type="application/x-ndjson"
+    )
+
+# Stored prompts. Listing is newest first and filters on industry and business
+# name (case-insensitive, indexed); search is keyword search over the prompts
+# and their answers.
+def require_prompt_store():
+    if prompt_store is None:
+        raise HTTPException(status_code=404, detail="The prompt store is disabled (PROMPT_STORE=0)")
+    return prompt_store
+
+def stored_answer_pairs(answers: Dict[str, str]) -> List[Any]:
+    # (label, answer) in interview order; keys the interview no longer has last
+    labels = {question["key"]: question.get("label", question["key"]) for stage in interview.stages for question in stage["questions"]}
+    ordered = [key for key in labels if key in answers] + [key for key in answers if key not in labels]
+    return [(labels.get(key, key), answers[key]) for key in ordered]
+
+@app.get("/prompts")
+async def list_prompts(industry: Optional[str] = None, business: Optional[str] = None,
+                       limit: int = 20, before: Optional[int] = None):
+    store = require_prompt_store()
+    return await store.latest(industry, business, min(max(limit, 1), 100), before)
+
+@app.get("/prompts/search")
+async def search_prompts(q: str, limit: int = 20):
+    store = require_prompt_store()
+    return await store.search(q, min(max(limit, 1), 100))
+
+@app.get("/prompts/{prompt_id}")
+async def get_prompt(prompt_id: str):
+    record = await require_prompt_store().get(prompt_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Prompt not found")
+    return record
+
+@app.post("/prompts/{prompt_id}/regenerate")
+async def regenerate_prompt(prompt_id: str):
+    # A new prompt from the stored answers with a single LLM3 call; it is stored
+    # as a new record whose parent_id is the original
+    store = require_prompt_store()
+    original = await store.get(prompt_id)
+    if original is None:
+        raise HTTPException(status_code=404, detail="Prompt not found")
+    messages = build_final_messages(format_answers(stored_answer_pairs(original["answers"])))
+    info: Dict[str, Any] = {}
+    started = time.perf_counter()
+    try:
+        response = await ainvoke_limited("llm3", messages, "regenerate", original["session_id"], info)
+    except ProvidersUnavailable as e:
+        raise unavailable_error(e)
+    except Overloaded as e:
+        raise overloaded_error(e)
+    record = new_record(
+        original["session_id"], original["answers"], response.content, "regenerate",
+        {"llm3": info.get("model"), "llm3_backend": info.get("backend")},
+        finalize_seconds=round(time.perf_counter() - started, 3),
+        parent_id=prompt_id,
+    )
+    store.add(record)
+    return record
+
+# WebSocket transport: one connection is bound to one session. Client messages:
+#   {"type": "turn", "text": "..."}   the user's answer
+#   {"type": "new_chat"}             drop the session and start a new one
+#   {"type": "pong"}                 optional reply to a heartbeat
+# The server pushes the same events as /generate/stream ("session", "banner",
+# "stage", "token", "done", "error") as soon as they exist, plus {"event": "ping"}
+# every WS_HEARTBEAT_SECONDS. Connecting with ?session_id=... resumes a session.
+# A turn keeps running when its connection drops; when one is still running,
+# the new connection takes it over: the turn's events so far are sent again,
+# then the rest as they are produced. Otherwise the last "done" event is sent
+# again (marked "replayed"), including the final prompt of a session that
+# finished while the client was away.
+WS_HEARTBEAT_SECONDS = float(os.getenv("WS_HEARTBEAT_SECONDS", "15"))
+WS_RESUME_MAX = int(os.getenv("WS_RESUME_MAX", "1000")) # sessions whose last result is kept
+
+last_results: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+def remember_result(event: Dict[str, Any]) -> None:
+    last_results[event["session_id"]] = event
+    last_results.move_to_end(event["session_id"])
+    while len(last_results) > WS_RESUME_MAX:
+        last_results.popitem(last=False)
+
+# Connections whose turn is still running, by session (this worker only)
+running_turns: Dict[str, "SessionSocket"] = {}
+
+class SessionSocket:
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.session_id: Optional[str] = None
+        self.connected = True
+        self.turn: Optional[asyncio.Task] = None
+        self.events: List[Dict[str, Any]] = [] # the current turn's events so far
+        self.sink = self # where the current turn's events go; a resuming connection takes over
+        self._send_lock = asyncio.Lock()
+
+    async def send(self, event: Dict[str, Any]) -> None:
+        # Events for a closed connection are dropped; the turn itself goes on
+        if not self.connected:
+            return
+        async with self._send_lock:
+            try:
+                await self.websocket.send_json(event)
+            except Exception:
+                self.connected = False
+
+    async def run(self, events: AsyncIterator[Dict[str, Any]]) -> None:
+        self.events = []
+        self.sink = self
+        try:
+            async for event in events:
+                if event["event"] == "session":
+                    self.session_id = event["session_id"]
+                    running_turns[self.session_id] = self
+                elif event["event"] == "done":
+                    remember_result(event)
+                await self.emit(event)
+        except HTTPException as e:
+            await self.emit(error_event(e))
+        except Exception as e:
+            logger.exception("WebSocket turn failed (session %s)", self.session_id)
+            await self.emit({"event": "error", "status": 500, "detail": str(e)})
+        finally:
+            if running_turns.get(self.session_id) is self:
+                del running_turns[self.session_id]
+
+    async def emit(self, event: Dict[str, Any]) -> None:
+        # Kept for a connection that takes the turn over (see follow)
+        self.events.append(event)
+        await self.sink.send(event)
+
+    async def follow(self, running: "SessionSocket") -> None:
+        # Take over a turn started on another connection: its events so far are
+        # replayed here, then the switch is made with no await in between, so
+        # every later event comes here directly and none is lost or repeated
+        self.turn = running.turn
+        events = running.events
+        sent = 0
+        while sent < len(events):
+            event = events[sent]
+            sent += 1
+            if event["event"] != "session":
+                await self.send(event)
+        if running.events is events:
+            running.sink = self
+
+    async def heartbeat(self) -> None:
+        while self.connected:
+            await asyncio.sleep(WS_HEARTBEAT_SECONDS)
+            await self.send({"event": "ping", "time": time.time()})
+
+    async def resume(self, session_id: str) -> bool:
+        running = running_turns.get(session_id)
+        result = last_results.get(session_id)
+        if running is None and result is None and await sessions.get(session_id) is None:
+            return False
+        self.session_id = session_id
+        await self.send({"event": "session", "session_id": session_id, "resumed": True})
+        if running is not None:
+            await self.follow(running)
+        elif result is not None:
+            await self.send({**result, "replayed": True})
+        return True
+
+    def start(self, events: AsyncIterator[Dict[str, Any]]) -> None:
+        self.turn = asyncio.create_task(self.run(events))
+
+@app.websocket("/ws")
+async def conversation_socket(websocket: WebSocket, session_id: Optional[str] = None):
+    await websocket.accept()
+    connection = SessionSocket(websocket)
+    heartbeat = asyncio.create_task(connection.heartbeat())
+    try:
+        if not (session_id and await connection.resume(session_id)):
+            connection.start(run_turn(None, "", stream=True)) # new session: greeting
+        while True:
+            message = await websocket.receive_json()
+            kind = message.get("type")
+            if kind == "pong":
+                continue
+            if connection.turn is not None and not connection.turn.done():
+                await connection.send({"event": "error", "status": 409, "detail": "A turn is already in progress"})
+            elif kind == "turn" and isinstance(message.get("text"), str) and len(message["text"]) > MAX_MESSAGE_CHARS:
+                await connection.send({"event": "error", "status": 422, "detail": f"Answers are limited to {MAX_MESSAGE_CHARS} characters"})
+            elif kind == "turn" and isinstance(message.get("text"), str):
+                connection.start(run_turn(connection.session_id, message["text"], stream=True))
+            elif kind == "new_chat":
+                if connection.session_id:
+                    await sessions.delete(connection.session_id)
+                    speculator.discard(f"draft:{connection.session_id}")
+                connection.start(run_turn(None, "", stream=True))
+            else:
+                await connection.send({"event": "error", "status": 400, "detail": f"Unknown message: {kind}"})
+    except (WebSocketDisconnect, ValueError):
+        pass # closed, or not JSON
+    finally:
+        connection.connected = False
+        heartbeat.cancel()
 
 @app.post("/new_chat", response_model=GenerateResponse)
 async def new_chat(request: Optional[Dict[str, Any]] = None):
     session_id = request.get("session_id") if request and "session_id" in request else None
-    if session_id and session_id in sessions:
-        del sessions[session_id] # Clean up existing session
+    if session_id:
+        await sessions.delete(session_id) # Clean up existing session
+        speculator.discard(f"draft:{session_id}")
 
-    # Start a new session
+    # Start a new session and get the initial greeting from model1
     new_session_id = str(uuid.uuid4())
-    sessions[new_session_id] = {
-        "chat_history": [SystemMessage(content=system_message_1)], # Initialize with stage 1 system message
-        "stage": 1,
-        "question_count": 0,
-        "messages_sent_to_frontend": []
-    }
-    
-    # Get initial greeting from model1 for the new chat
     try:
-        initial_response = model1.invoke(sessions[new_session_id]["chat_history"])
-        sessions[new_session_id]["chat_history"].append(AIMessage(content=initial_response.content))
-        return GenerateResponse(
-            prompt=initial_response.content,
-            session_id=new_session_id, # Crucially, return the new session ID
-            status="continue",
-            is_final_prompt=False
-        )
+        return await collect_turn(start_session(new_session_id))
+    except ProvidersUnavailable as e:
+        raise unavailable_error(e)
+    except Overloaded as e:
+        raise overloaded_error(e)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to start new chat: {e}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Failed to start new chat: {e}")
+
+IMPORT_SECONDS = time.perf_counter() - _import_started
@@ -0,0 +1,172 @@
+from typing import Any, Callable, Dict, List
+from dotenv import load_dotenv
+from router import CircuitBreaker, ModelRouter, Provider
+import asyncio
+import os
+import threading
+
+# Backend selection below is read from the environment at import time
+load_dotenv()
+
+# Model registry. Each distinct backend is built once, on first use, and the same
+# client (with its HTTP/gRPC connection pool) is reused by every role and every
+# request that points at it. Building lazily keeps the langchain_huggingface and
+# langchain_google_genai imports off the module import path, so uvicorn can bind
+# its port before those stacks are loaded. On the event loop, use aget_model /
+# aget_backend (or the router), which build in a worker thread: a build takes
+# seconds, and tens of seconds for the local model.
+#
+# Roles are the call sites in the conversation flow:
+#   model1 -> stage 1 interviewer, model2 -> stage 2 interviewer, llm3 -> final prompt
+# MODEL1_BACKEND / MODEL2_BACKEND / LLM3_BACKEND pick the backends for a role;
+# calls go through the role's ModelRouter (fallback, hedging, circuit breaking
+# and rate limiting, see router.py).
+
+def _build_hf_gemma():
+    from langchain_huggingface import HuggingFaceEndpoint, ChatHuggingFace
+
+    llm = HuggingFaceEndpoint(
+        repo_id="google/gemma-2-2b-it",
+        task="text-generation",
+        # hf_token=os.getenv("HF_API_TOKEN")
+    )
+    return ChatHuggingFace(llm=llm)
+
+def _build_gemini_flash():
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    return ChatGoogleGenerativeAI(
+        model="gemini-1.5-flash",
+        temperature=1,
+        max_tokens=500,
+        max_retries=2,
+        google_api_key=os.getenv("GOOGLE_API_KEY")
+    )
+
+def _build_fake():
+    # Offline stand-in for benchmarks (see fake_llm.py and bench.py)
+    from fake_llm import FakeChatModel
+
+    return FakeChatModel(
+        token_latency=float(os.getenv("FAKE_TOKEN_LATENCY", "0.02")),
+        input_token_latency=float(os.getenv("FAKE_INPUT_TOKEN_LATENCY", "0")),
+        output_tokens=int(os.getenv("FAKE_OUTPUT_TOKENS", "40")),
+    )
+
+def _build_local():
+    # Quantized small model on this machine's CPU, with cross-session batching
+    # (see local_llm.py); needs torch and transformers
+    from local_llm import BatchScheduler, LocalChatModel, LocalEngine
+
+    engine = LocalEngine(
+        os.getenv("LOCAL_MODEL_ID", "google/gemma-2-2b-it"),
+        threads=int(os.getenv("LOCAL_THREADS", "0")),
+        quantize=os.getenv("LOCAL_QUANTIZE", "1") == "1",
+        # KV states kept for prefix reuse, in tokens (0 to disable)
+        prefix_cache_tokens=int(os.getenv("LOCAL_PREFIX_CACHE_TOKENS", "8192")),
+    )
+    return LocalChatModel(
+        model_id=engine.model_id,
+        max_new_tokens=int(os.getenv("LOCAL_MAX_NEW_TOKENS", "256")),
+        temperature=float(os.getenv("LOCAL_TEMPERATURE", "0.7")),
+        scheduler=BatchScheduler(
+            engine,
+            max_batch=int(os.getenv("LOCAL_MAX_BATCH", "8")),
+            max_wait=float(os.getenv("LOCAL_MAX_WAIT_MS", "20")) / 1000,
+        ),
+    )
+
+BACKENDS: Dict[str, Callable[[], Any]] = {
+    "hf_gemma": _build_hf_gemma,
+    "gemini_flash": _build_gemini_flash,
+    "fake": _build_fake,
+    "local": _build_local,
+}
+
+# Max in-flight calls per backend from this worker
+BACKEND_CONCURRENCY: Dict[str, int] = {
+    "hf_gemma": int(os.getenv("HF_MAX_CONCURRENCY", "8")),
+    "gemini_flash": int(os.getenv("GEMINI_MAX_CONCURRENCY", "4")),
+    "fake": int(os.getenv("FAKE_MAX_CONCURRENCY", "64")),
+    # Enough in flight to fill several batches; the scheduler queues the rest
+    "local": int(os.getenv("LOCAL_MAX_CONCURRENCY", "32")),
+}
+
+# Calls per minute allowed per backend (token bucket), 0 for no limit
+BACKEND_RATE_PER_MINUTE: Dict[str, float] = {
+    "hf_gemma": float(os.getenv("HF_RATE_PER_MINUTE", "0")),
+    "gemini_flash": float(os.getenv("GEMINI_RATE_PER_MINUTE", "0")),
+}
+
+# Each role is an ordered, comma-separated list of backends: the first is the
+# primary, the rest are fallbacks (and hedge targets), e.g. "hf_gemma,gemini_flash"
+# or "local,gemini_flash" to run the interviewers on this machine's CPU
+ROLES: Dict[str, List[str]] = {
+    "model1": os.getenv("MODEL1_BACKEND", "hf_gemma,gemini_flash").split(","),
+    "model2": os.getenv("MODEL2_BACKEND", "hf_gemma,gemini_flash").split(","),
+    "llm3": os.getenv("LLM3_BACKEND", "gemini_flash").split(","),
+}
+
+CIRCUIT_FAILURES = int(os.getenv("CIRCUIT_FAILURES", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+HEDGE = os.getenv("HEDGE", "1") == "1"
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+
+_models: Dict[str, Any] = {}
+_providers: Dict[str, Provider] = {}
+_routers: Dict[str, ModelRouter] = {}
+_lock = threading.Lock()
+
+def get_backend(name: str) -> Any:
+    model = _models.get(name)
+    if model is None:
+        with _lock:
+            model = _models.get(name)
+            if model is None:
+                if name not in BACKENDS:
+                    raise ValueError(f"Unknown model backend: {name}")
+                model = _models[name] = BACKENDS[name]()
+    return model
+
+def get_model(role: str) -> Any:
+    # The role's primary backend
+    return get_backend(ROLES[role][0])
+
+async def aget_backend(name: str) -> Any:
+    model = _models.get(name)
+    return model if model is not None else await asyncio.to_thread(get_backend, name)
+
+async def aget_model(role: str) -> Any:
+    return await aget_backend(ROLES[role][0])
+
+def get_provider(name: str) -> Provider:
+    # One provider per backend, so roles sharing a backend share its
+    # concurrency limit, rate limit and circuit breaker
+    if name not in _providers:
+        _providers[name] = Provider(
+            name,
+            get_backend,
+            BACKEND_CONCURRENCY.get(name, 4),
+            BACKEND_RATE_PER_MINUTE.get(name, 0),
+            CircuitBreaker(CIRCUIT_FAILURES, CIRCUIT_RESET_SECONDS),
+        )
+    return _providers[name]
+
+def get_router(role: str) -> ModelRouter:
+    if role not in _routers:
+        _routers[role] = ModelRouter(role, [get_provider(name) for name in ROLES[role]], HEDGE, HEDGE_MIN_SAMPLES)
+    return _routers[role]
+
+def active_providers() -> List[Provider]:
+    return list(_providers.values())
+
+def preload() -> Dict[str, Exception]:
+    # Build every backend in use; run off the event loop at startup. Returns the
+    # backends that failed to build (they are tried again on first use).
+    errors = {}
+    for name in sorted({name for names in ROLES.values() for name in names}):
+        try:
+            get_backend(name)
+        except Exception as e:
+            errors[name] = e
+    return errors
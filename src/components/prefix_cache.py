@@ -0,0 +1,84 @@
+from collections import OrderedDict
+from typing import Any, List, Optional, Sequence, Tuple
+import hashlib
+import threading
+
+# Prefix cache hook for backends that can reuse computed state (a local model's
+# KV cache, a provider's cached-context handle) for the start of a prompt they
+# have already processed. Entries are keyed by a chain of hashes over fixed-size
+# blocks of token ids, so a lookup finds the longest cached prefix of a new
+# prompt in one pass: the system prompt shared by every session, or a session's
+# previous turn (context.compact_history keeps each call's input an append-only
+# extension of the previous one).
+#
+# The cache only stores opaque states and their lengths in tokens; the backend
+# decides what a state is and how to resume from it. Bounded by the total number
+# of cached tokens, least recently used first out.
+
+BLOCK_SIZE = 16
+
+
+def block_hashes(tokens: Sequence[int], block_size: int = BLOCK_SIZE) -> List[str]:
+    # hashes[i] identifies tokens[:(i + 1) * block_size]
+    hashes = []
+    digest = b""
+    for end in range(block_size, len(tokens) + 1, block_size):
+        digest = hashlib.sha1(digest + repr(tuple(tokens[end - block_size:end])).encode("ascii")).digest()
+        hashes.append(digest.hex())
+    return hashes
+
+
+class PrefixCache:
+    def __init__(self, max_tokens: int = 8192, block_size: int = BLOCK_SIZE):
+        self.max_tokens = max_tokens
+        self.block_size = block_size
+        self._entries: "OrderedDict[str, Tuple[int, Any]]" = OrderedDict()
+        self._tokens = 0
+        self._lock = threading.Lock() # used from the model thread and the event loop
+        self.hits = 0
+        self.misses = 0
+        self.tokens_reused = 0
+
+    def usable_length(self, length: int) -> int:
+        # Longest block-aligned prefix that still leaves one token to prefill
+        # (the model needs at least one new input position to produce logits)
+        return ((length - 1) // self.block_size) * self.block_size if length > 0 else 0
+
+    def lookup(self, tokens: Sequence[int]) -> Tuple[int, Optional[Any]]:
+        # (matched length in tokens, state), or (0, None)
+        hashes = block_hashes(tokens[:self.usable_length(len(tokens))], self.block_size)
+        with self._lock:
+            for key in reversed(hashes):
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    self.tokens_reused += entry[0]
+                    return entry
+            self.misses += 1
+        return 0, None
+
+    def contains(self, tokens: Sequence[int]) -> bool:
+        hashes = block_hashes(tokens, self.block_size)
+        with self._lock:
+            return bool(hashes) and hashes[-1] in self._entries
+
+    def store(self, tokens: Sequence[int], state: Any) -> None:
+        # `tokens` must be block-aligned (see usable_length) and `state` must
+        # cover exactly those tokens
+        length = len(tokens)
+        if length == 0 or length % self.block_size or length > self.max_tokens:
+            return
+        key = block_hashes(tokens, self.block_size)[-1]
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._tokens -= previous[0]
+            self._entries[key] = (length, state)
+            self._tokens += length
+            while self._tokens > self.max_tokens:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._tokens -= evicted
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,241 @@
+from typing import Any, Dict, List, Optional
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+# Durable store for finished prompts. Every final prompt is saved with the
+# answers it was made from, the models and timings, and the session id, so a
+# client that lost the response (or a user coming back later) can fetch it, and
+# a prompt can be regenerated from its answers with a single LLM3 call.
+#
+# The table is append-only (regenerating adds a new row pointing at its parent;
+# UPDATE and DELETE are refused by triggers). Writes never wait on disk: add()
+# queues the row and a background task inserts queued rows in batches. Rows are
+# readable by id from memory until they are written. Keyword search uses an
+# FTS5 index over the prompt and the answer values (not the JSON keys) when
+# SQLite has FTS5, LIKE otherwise. Answers are stored as UTF-8 JSON, so
+# non-ASCII words are searchable as typed.
+
+logger = logging.getLogger("prompt_engine.prompt_store")
+
+COLUMNS = ("id", "session_id", "created_at", "industry", "business", "answers", "prompt",
+           "source", "models", "finalize_seconds", "session_seconds", "parent_id")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS prompts (
+    seq INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    session_id TEXT,
+    created_at REAL NOT NULL,
+    industry TEXT COLLATE NOCASE,
+    business TEXT COLLATE NOCASE,
+    answers TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    source TEXT NOT NULL,
+    models TEXT NOT NULL,
+    finalize_seconds REAL,
+    session_seconds REAL,
+    parent_id TEXT
+);
+CREATE INDEX IF NOT EXISTS prompts_industry ON prompts (industry, seq);
+CREATE INDEX IF NOT EXISTS prompts_business ON prompts (business, seq);
+CREATE INDEX IF NOT EXISTS prompts_session ON prompts (session_id);
+CREATE TRIGGER IF NOT EXISTS prompts_no_update BEFORE UPDATE ON prompts
+    BEGIN SELECT RAISE(ABORT, 'prompts are append-only'); END;
+CREATE TRIGGER IF NOT EXISTS prompts_no_delete BEFORE DELETE ON prompts
+    BEGIN SELECT RAISE(ABORT, 'prompts are append-only'); END;
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS prompts_fts USING fts5(
+    prompt, answers, industry, business, content=''
+);
+CREATE TRIGGER IF NOT EXISTS prompts_fts_insert AFTER INSERT ON prompts BEGIN
+    INSERT INTO prompts_fts (rowid, prompt, answers, industry, business)
+    VALUES (new.seq, new.prompt, (SELECT group_concat(value, ' ') FROM json_each(new.answers)),
+            new.industry, new.business);
+END;
+"""
+
+
+def new_record(session_id: Optional[str], answers: Dict[str, str], prompt: str, source: str,
+               models: Dict[str, str], finalize_seconds: Optional[float] = None,
+               session_seconds: Optional[float] = None, parent_id: Optional[str] = None) -> Dict[str, Any]:
+    return {
+        "id": uuid.uuid4().hex,
+        "session_id": session_id,
+        "created_at": time.time(),
+        "industry": answers.get("industry"),
+        "business": answers.get("business_name"),
+        "answers": answers,
+        "prompt": prompt,
+        "source": source,
+        "models": models,
+        "finalize_seconds": finalize_seconds,
+        "session_seconds": session_seconds,
+        "parent_id": parent_id,
+    }
+
+
+class PromptStore:
+    def __init__(self, path: str, batch_size: int = 50, flush_seconds: float = 0.5):
+        self.batch_size = max(batch_size, 1)
+        self.flush_seconds = flush_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        try:
+            self._conn.executescript(FTS_SCHEMA)
+            self.fts = True
+        except sqlite3.OperationalError:
+            logger.warning("SQLite was built without FTS5, prompt search falls back to LIKE")
+            self.fts = False
+        self._pending: Dict[str, Dict[str, Any]] = {} # queued, not yet written
+        self._queue: Optional["asyncio.Queue[Dict[str, Any]]"] = None
+        self._writer: Optional[asyncio.Task] = None
+        self.written = 0
+
+    def _execute(self, sql: str, params: tuple = ()) -> List[Dict[str, Any]]:
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            names = [column[0] for column in cursor.description or ()]
+            return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+    def _insert(self, records: List[Dict[str, Any]]) -> None:
+        rows = [
+            tuple(json.dumps(record[c], ensure_ascii=False) if c in ("answers", "models") else record[c] for c in COLUMNS)
+            for record in records
+        ]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    f"INSERT INTO prompts ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})", rows
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def add(self, record: Dict[str, Any]) -> None:
+        # Queue a record for the background writer; returns at once
+        if self._writer is None or self._writer.done():
+            self._queue = asyncio.Queue()
+            for queued in self._pending.values():
+                self._queue.put_nowait(queued) # left over from a writer that stopped
+            self._writer = asyncio.create_task(self._write())
+        self._pending[record["id"]] = record
+        self._queue.put_nowait(record)
+
+    async def _write(self) -> None:
+        queue = self._queue
+        while True:
+            batch = [await queue.get()]
+            await asyncio.sleep(self.flush_seconds) # let concurrent finishes join the batch
+            while len(batch) < self.batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            await self._flush_batch(batch)
+
+    async def _flush_batch(self, batch: List[Dict[str, Any]]) -> None:
+        try:
+            await asyncio.to_thread(self._insert, batch)
+        except sqlite3.IntegrityError:
+            # One bad row (e.g. a duplicate id) must not lose the rest
+            for record in batch:
+                try:
+                    await asyncio.to_thread(self._insert, [record])
+                except sqlite3.Error:
+                    logger.exception("dropping prompt %s", record["id"])
+        except Exception:
+            logger.exception("prompt store write failed, %d prompts kept in memory", len(batch))
+            await asyncio.sleep(1)
+            for record in batch:
+                self._queue.put_nowait(record)
+            return
+        for record in batch:
+            self._pending.pop(record["id"], None)
+        self.written += len(batch)
+
+    async def flush(self) -> None:
+        # Write everything still queued (shutdown)
+        if self._writer is not None:
+            self._writer.cancel()
+            self._writer = None
+        batch = list(self._pending.values())
+        for start in range(0, len(batch), self.batch_size):
+            await self._flush_batch(batch[start:start + self.batch_size])
+
+    @staticmethod
+    def _decode(row: Dict[str, Any]) -> Dict[str, Any]:
+        row["answers"] = json.loads(row["answers"])
+        row["models"] = json.loads(row["models"])
+        return row
+
+    def _pending_matching(self, industry: Optional[str], business: Optional[str]) -> List[Dict[str, Any]]:
+        def matches(value: Optional[str], wanted: Optional[str]) -> bool:
+            return wanted is None or (value or "").lower() == wanted.lower()
+        return [
+            {**record, "seq": None} for record in reversed(list(self._pending.values()))
+            if matches(record["industry"], industry) and matches(record["business"], business)
+        ]
+
+    async def get(self, prompt_id: str) -> Optional[Dict[str, Any]]:
+        if prompt_id in self._pending:
+            return {**self._pending[prompt_id], "seq": None}
+        rows = await asyncio.to_thread(self._execute, "SELECT * FROM prompts WHERE id = ?", (prompt_id,))
+        return self._decode(rows[0]) if rows else None
+
+    async def latest(self, industry: Optional[str] = None, business: Optional[str] = None,
+                   limit: int = 20, before: Optional[int] = None) -> List[Dict[str, Any]]:
+        # Newest first; `before` is the seq of the last row of the previous page.
+        # Rows not written yet (seq null) are listed on the first page only, on
+        # top of `limit`, so the last row of a page always carries a seq.
+        where, params = [], []
+        if industry:
+            where.append("industry = ?")
+            params.append(industry)
+        if business:
+            where.append("business = ?")
+            params.append(business)
+        if before is not None:
+            where.append("seq < ?")
+            params.append(before)
+        sql = "SELECT * FROM prompts" + (f" WHERE {' AND '.join(where)}" if where else "") + " ORDER BY seq DESC LIMIT ?"
+        rows = await asyncio.to_thread(self._execute, sql, tuple(params) + (limit,))
+        recent = [] if before is not None else self._pending_matching(industry, business)
+        return recent + [self._decode(row) for row in rows]
+
+    async def search(self, query: str, limit: int = 20) -> List[Dict[str, Any]]:
+        # Keyword search over prompts and answers, best matches first
+        if self.fts:
+            # Each word is quoted so user input is never parsed as FTS syntax
+            terms = " ".join('"%s"' % word.replace('"', '""') for word in query.split())
+            if not terms:
+                return []
+            sql = ("SELECT prompts.* FROM prompts_fts JOIN prompts ON prompts.seq = prompts_fts.rowid "
+                   "WHERE prompts_fts MATCH ? ORDER BY bm25(prompts_fts) LIMIT ?")
+            rows = await asyncio.to_thread(self._execute, sql, (terms, limit))
+        else:
+            pattern = f"%{query}%"
+            sql = ("SELECT * FROM prompts WHERE prompt LIKE ? OR EXISTS "
+                   "(SELECT 1 FROM json_each(prompts.answers) WHERE value LIKE ?) ORDER BY seq DESC LIMIT ?")
+            rows = await asyncio.to_thread(self._execute, sql, (pattern, pattern, limit))
+        return [self._decode(row) for row in rows]
+
+
+def create_prompt_store() -> Optional[PromptStore]:
+    # PROMPT_STORE=0 to disable; PROMPT_DB_PATH is the SQLite file
+    if os.getenv("PROMPT_STORE", "1") != "1":
+        return None
+    return PromptStore(
+        os.getenv("PROMPT_DB_PATH", "prompts.db"),
+        batch_size=int(os.getenv("PROMPT_STORE_BATCH", "50")),
+        flush_seconds=float(os.getenv("PROMPT_STORE_FLUSH_SECONDS", "0.5")),
+    )
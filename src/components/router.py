@@ -0,0 +1,291 @@
+from collections import deque
+from typing import Any, AsyncIterator, Callable, List, Optional
+import asyncio
+import logging
+import time
+
+from admission import DEADLINES, AdmissionGate, Overloaded
+from llm_cache import model_fingerprint
+from ratelimit import TokenBucket
+
+# Model router behind each role (model1, model2, llm3). A role has an ordered
+# list of providers (backends from the registry); a call goes to the first one
+# that is healthy and within its rate limit, and falls back down the list when a
+# provider fails. Non-streamed calls are hedged: when the provider has not
+# answered within its recent p95 latency, counted from when the call got its
+# slot (queueing is load, not a slow provider), a duplicate request goes to the
+# next provider and the first reply wins.
+#
+# Each provider admits calls through an AdmissionGate (see admission.py): a call
+# carries a priority class and one queue deadline shared by all its fallbacks.
+# A call shed by every provider raises admission.Overloaded.
+#
+# The optional `span` argument is a telemetry.ModelSpan; the router records the
+# provider actually used, when a slot was granted and how many retries it took.
+
+logger = logging.getLogger("prompt_engine.router")
+
+
+class ProvidersUnavailable(Exception):
+    # Every provider for the role failed, is rate limited or has its circuit open
+    def __init__(self, role: str, retry_after: float, last_error: Optional[BaseException] = None):
+        super().__init__(f"No model provider available for {role}: {last_error or 'all circuits open'}")
+        self.role = role
+        self.retry_after = retry_after
+        self.last_error = last_error
+
+
+class CircuitBreaker:
+    # closed -> open after `failure_threshold` consecutive failures; after
+    # `reset_seconds` one trial call is let through (half-open) and its outcome
+    # closes or re-opens the circuit
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.reset_seconds else "open"
+
+    def retry_after(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        return max(self.reset_seconds - (time.monotonic() - self.opened_at), 0.0)
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
+class LatencyWindow:
+    def __init__(self, size: int = 200):
+        self.samples = deque(maxlen=size)
+
+    def add(self, seconds: float) -> None:
+        self.samples.append(seconds)
+
+    def p95(self, min_samples: int) -> Optional[float]:
+        if len(self.samples) < min_samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)]
+
+
+class Provider:
+    def __init__(self, name: str, build: Callable[[str], Any], concurrency: int, rate_per_minute: float,
+                 breaker: CircuitBreaker):
+        self.name = name
+        self._build = build
+        self.gate = AdmissionGate(name, concurrency)
+        self.bucket = TokenBucket(rate_per_minute / 60, capacity=max(concurrency, 1)) if rate_per_minute > 0 else None
+        self.breaker = breaker
+        self.latency = LatencyWindow()
+        self._model: Any = None
+
+    async def load(self) -> Any:
+        # The client is built in a worker thread on first use, so a slow build
+        # (seconds for the HF/Gemini stacks, longer for a local model) never
+        # blocks the event loop
+        if self._model is None:
+            self._model = await asyncio.to_thread(self._build, self.name)
+        return self._model
+
+    @property
+    def model(self) -> Any:
+        if self._model is None:
+            self._model = self._build(self.name)
+        return self._model
+
+    def model_id(self) -> str:
+        return model_fingerprint(self.model)["model"]
+
+
+class ModelRouter:
+    def __init__(self, role: str, providers: List[Provider], hedge: bool = True, hedge_min_samples: int = 20):
+        self.role = role
+        self.providers = providers
+        self.hedge = hedge
+        self.hedge_min_samples = hedge_min_samples
+
+    def _admit(self, provider: Provider, last: bool) -> bool:
+        # Circuit first, then the rate limit; the last provider in the list waits
+        # for a token instead of being skipped
+        if not provider.breaker.allow():
+            return False
+        if provider.bucket is not None and not last and not provider.bucket.try_acquire():
+            provider.breaker.trial_in_flight = False
+            return False
+        return True
+
+    def _unavailable(self, last_error: Optional[BaseException]) -> Exception:
+        if isinstance(last_error, Overloaded):
+            return last_error
+        retry_after = min((p.breaker.retry_after() for p in self.providers), default=0.0)
+        return ProvidersUnavailable(self.role, max(retry_after, 1.0), last_error)
+
+    async def _enter(self, provider: Provider, priority: str, deadline: float) -> None:
+        try:
+            await provider.gate.acquire(priority, deadline)
+        except Overloaded:
+            provider.breaker.trial_in_flight = False # shed before reaching the backend
+            raise
+
+    async def _call(self, provider: Provider, messages: List[Any], span: Any, last: bool,
+                    priority: str, deadline: float, admitted: Optional[asyncio.Event] = None) -> Any:
+        try:
+            model = await provider.load()
+        except Exception:
+            provider.breaker.record_failure() # the client could not be built
+            raise
+        if provider.bucket is not None and last:
+            await provider.bucket.acquire()
+        await self._enter(provider, priority, deadline)
+        if admitted is not None:
+            admitted.set()
+        if span is not None:
+            span.backend = provider.name
+            span.model = provider.model_id()
+            span.acquired()
+        started = time.perf_counter()
+        try:
+            response = await model.ainvoke(messages)
+        except asyncio.CancelledError:
+            provider.breaker.trial_in_flight = False # lost a hedge race, not a failure
+            raise
+        except Exception:
+            provider.breaker.record_failure()
+            raise
+        finally:
+            provider.gate.release(time.perf_counter() - started)
+        provider.latency.add(time.perf_counter() - started)
+        provider.breaker.record_success()
+        return response
+
+    async def _hedged(self, provider: Provider, backup: Optional[Provider], messages: List[Any], span: Any, last: bool,
+                      priority: str, deadline: float) -> Any:
+        admitted = asyncio.Event()
+        first = asyncio.create_task(self._call(provider, messages, span, last, priority, deadline, admitted))
+        pending = {first}
+        try:
+            delay = provider.latency.p95(self.hedge_min_samples) if self.hedge else None
+            if delay is not None and backup is not None:
+                # The hedge delay runs from when the primary got its slot
+                granted = asyncio.create_task(admitted.wait())
+                try:
+                    await asyncio.wait({first, granted}, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    granted.cancel()
+                if not first.done():
+                    await asyncio.wait(pending, timeout=delay)
+                if not first.done() and self._admit(backup, last=False):
+                    logger.info("hedging %s: %s slower than p95 %.2fs, duplicating on %s", self.role, provider.name, delay, backup.name)
+                    if span is not None:
+                        span.retries += 1
+                    pending.add(asyncio.create_task(self._call(backup, messages, None, False, priority, deadline)))
+
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first and span is not None:
+                            # The backup won: the span reports what served the call
+                            span.backend = backup.name
+                            span.model = backup.model_id()
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # The losing (or abandoned) request is cancelled
+            for task in pending:
+                task.cancel()
+
+    async def ainvoke(self, messages: List[Any], span: Any = None, priority: str = "turn") -> Any:
+        deadline = time.monotonic() + DEADLINES.get(priority, 30)
+        last_error: Optional[BaseException] = None
+        for i, provider in enumerate(self.providers):
+            last = i == len(self.providers) - 1
+            if not self._admit(provider, last):
+                continue
+            backup = next((p for p in self.providers[i + 1:] if p.breaker.state != "open"), None)
+            try:
+                return await self._hedged(provider, backup, messages, span, last, priority, deadline)
+            except Exception as e:
+                last_error = e
+                logger.warning("%s call to %s failed (%s), trying next provider", self.role, provider.name, type(e).__name__)
+                if span is not None:
+                    span.retries += 1
+        raise self._unavailable(last_error)
+
+    async def astream(self, messages: List[Any], span: Any = None, priority: str = "turn") -> AsyncIterator[Any]:
+        # Falls back only until the first chunk has been sent; no hedging
+        deadline = time.monotonic() + DEADLINES.get(priority, 30)
+        last_error: Optional[BaseException] = None
+        for i, provider in enumerate(self.providers):
+            last = i == len(self.providers) - 1
+            if not self._admit(provider, last):
+                continue
+            try:
+                model = await provider.load()
+            except Exception as e:
+                provider.breaker.record_failure()
+                last_error = e
+                logger.warning("%s backend %s could not be built (%s), trying next provider", self.role, provider.name, type(e).__name__)
+                continue
+            if provider.bucket is not None and last:
+                await provider.bucket.acquire()
+            started_output = False
+            try:
+                await self._enter(provider, priority, deadline)
+            except Overloaded as e:
+                last_error = e
+                logger.warning("%s stream shed by %s (%s), trying next provider", self.role, provider.name, e.reason)
+                continue
+            if span is not None:
+                span.backend = provider.name
+                span.model = provider.model_id()
+                span.acquired()
+            started = time.perf_counter()
+            try:
+                async for chunk in model.astream(messages):
+                    started_output = True
+                    yield chunk
+            except (asyncio.CancelledError, GeneratorExit):
+                provider.breaker.trial_in_flight = False # consumer went away, not a failure
+                raise
+            except Exception as e:
+                provider.breaker.record_failure()
+                if started_output:
+                    raise
+                last_error = e
+                logger.warning("%s stream from %s failed (%s), trying next provider", self.role, provider.name, type(e).__name__)
+                if span is not None:
+                    span.retries += 1
+                continue
+            finally:
+                provider.gate.release(time.perf_counter() - started)
+            provider.latency.add(time.perf_counter() - started)
+            provider.breaker.record_success()
+            return
+        raise self._unavailable(last_error)
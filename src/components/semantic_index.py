@@ -0,0 +1,208 @@
+from typing import Any, Dict, List, Optional, Tuple
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+
+try:
+    import fcntl
+except ImportError: # Windows: no advisory locks, every process saves
+    fcntl = None
+
+import numpy as np
+
+# Near-duplicate lookup for finished prompts. Each final prompt is stored with an
+# embedding of the interview answers it was generated from; a new session whose
+# answers are close enough gets the stored prompt adapted by LLM3 (a short task)
+# instead of a generation from scratch (see main.py for the thresholds).
+#
+# Embeddings come from a local sentence-transformers model when that package is
+# installed (SEMANTIC_MODEL), otherwise from hashed word and character n-grams,
+# which is enough to catch "same industry, same answers, different wording".
+# Vectors are L2-normalised, so cosine similarity is a dot product.
+#
+# The index keeps at most `max_entries` rows in one preallocated float32 matrix
+# (a ring buffer: the oldest entry is replaced first). Above `exact_below` rows,
+# candidates come from random-hyperplane LSH buckets and only those are scored.
+# It is saved to a .npz file (plus the prompts as JSON) and reloaded at start.
+#
+# Every uvicorn worker keeps its own index in memory and loads the file at
+# start, but only one worker writes it: the first to take an exclusive lock on
+# "<path>.lock". The others never save, so workers do not overwrite each other's
+# file; what they add is served from memory until they restart.
+
+logger = logging.getLogger("prompt_engine.semantic_index")
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+class HashingEmbedder:
+    name = "hashing-v1"
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+
+    def _features(self, text: str) -> List[str]:
+        words = _WORD.findall(text.lower())
+        features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+        for word in words:
+            padded = f"<{word}>"
+            features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+        return features
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+                bucket = int.from_bytes(digest[:4], "little") % self.dim
+                vectors[row, bucket] += 1.0 if digest[4] & 1 else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+class SentenceEmbedder:
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.name = model_name
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        return self.model.encode(texts, normalize_embeddings=True, convert_to_numpy=True).astype(np.float32)
+
+
+def create_embedder() -> Any:
+    model_name = os.getenv("SEMANTIC_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+    if model_name != "hashing":
+        try:
+            return SentenceEmbedder(model_name)
+        except ImportError:
+            logger.info("sentence-transformers not installed, using hashed n-gram embeddings")
+        except Exception as e:
+            # e.g. the model cannot be downloaded on an offline host
+            logger.warning("could not load %s (%s), using hashed n-gram embeddings", model_name, e)
+    return HashingEmbedder()
+
+
+class SemanticIndex:
+    def __init__(self, embedder: Any, max_entries: int = 10000, path: Optional[str] = None,
+                 bits: int = 12, tables: int = 4, exact_below: int = 4096, seed: int = 0):
+        self.embedder = embedder
+        self.max_entries = max(max_entries, 1)
+        self.path = path
+        self.exact_below = exact_below
+        self.vectors = np.zeros((self.max_entries, embedder.dim), dtype=np.float32)
+        self.entries: List[Optional[Dict[str, Any]]] = [None] * self.max_entries
+        self.count = 0 # rows filled
+        self.next_row = 0 # ring buffer position
+        planes = np.random.default_rng(seed).standard_normal((tables, embedder.dim, bits)).astype(np.float32)
+        self.planes = planes
+        self.buckets: List[Dict[int, set]] = [{} for _ in range(tables)]
+        self._weights = 1 << np.arange(bits, dtype=np.int64)
+        self._lock = threading.Lock()
+        self.dirty = 0
+        self.lookups = {"reuse": 0, "adapt": 0, "miss": 0}
+        self._writer_lock = None
+        self.writer = bool(path) and self._claim_writer()
+        if path:
+            self.load()
+
+    def _claim_writer(self) -> bool:
+        # True when this process may save the index file (see above)
+        if fcntl is None:
+            return True
+        handle = open(f"{self.path}.lock", "a")
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            logger.info("semantic index %s is saved by another worker, keeping additions in memory", self.path)
+            return False
+        self._writer_lock = handle # held for the life of the process
+        return True
+
+    def _signatures(self, vector: np.ndarray) -> List[int]:
+        bits = np.einsum("d,tdb->tb", vector, self.planes) > 0
+        return (bits.astype(np.int64) @ self._weights).tolist()
+
+    def add(self, text: str, entry: Dict[str, Any]) -> None:
+        vector = self.embedder.embed([text])[0]
+        with self._lock:
+            row = self.next_row
+            if self.entries[row] is not None:
+                for table, signature in zip(self.buckets, self._signatures(self.vectors[row])):
+                    table.get(signature, set()).discard(row)
+            self.vectors[row] = vector
+            self.entries[row] = entry
+            for table, signature in zip(self.buckets, self._signatures(vector)):
+                table.setdefault(signature, set()).add(row)
+            self.next_row = (row + 1) % self.max_entries
+            self.count = min(self.count + 1, self.max_entries)
+            self.dirty += 1
+
+    def search(self, text: str) -> Optional[Tuple[float, Dict[str, Any]]]:
+        # (similarity, entry) of the nearest stored entry, or None when empty
+        vector = self.embedder.embed([text])[0]
+        with self._lock:
+            if self.count == 0:
+                return None
+            if self.count <= self.exact_below:
+                candidates = np.arange(self.count)
+            else:
+                rows = set()
+                for table, signature in zip(self.buckets, self._signatures(vector)):
+                    rows |= table.get(signature, set())
+                if not rows:
+                    return None
+                candidates = np.fromiter(rows, dtype=np.int64)
+            scores = self.vectors[candidates] @ vector
+            best = int(np.argmax(scores))
+            return float(scores[best]), self.entries[int(candidates[best])]
+
+    def save(self) -> None:
+        if not self.writer:
+            self.dirty = 0
+            return
+        with self._lock:
+            # Oldest first, so a smaller max_entries on reload keeps the newest
+            order = np.roll(np.arange(self.count), -self.next_row) if self.count == self.max_entries else np.arange(self.count)
+            vectors = self.vectors[order]
+            entries = json.dumps([self.entries[row] for row in order])
+            self.dirty = 0
+        tmp = f"{self.path}.tmp.npz"
+        np.savez(tmp, vectors=vectors, embedder=np.array(self.embedder.name), entries=np.array(entries))
+        os.replace(tmp, self.path)
+
+    def load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        data = np.load(self.path, allow_pickle=False)
+        if str(data["embedder"]) != self.embedder.name or data["vectors"].shape[1] != self.embedder.dim:
+            logger.warning("semantic index %s was built with %s, starting empty", self.path, data["embedder"])
+            return
+        vectors = data["vectors"][-self.max_entries:]
+        entries = json.loads(str(data["entries"]))[-self.max_entries:]
+        count = len(entries)
+        self.vectors[:count] = vectors
+        self.entries[:count] = entries
+        self.count = count
+        self.next_row = count % self.max_entries
+        for row in range(count):
+            for table, signature in zip(self.buckets, self._signatures(self.vectors[row])):
+                table.setdefault(signature, set()).add(row)
+        logger.info("semantic index: loaded %d prompts from %s", count, self.path)
+
+
+def create_semantic_index() -> Optional[SemanticIndex]:
+    # SEMANTIC_INDEX=1 to enable; SEMANTIC_INDEX_PATH persists it across restarts
+    if os.getenv("SEMANTIC_INDEX", "0") != "1":
+        return None
+    return SemanticIndex(
+        create_embedder(),
+        max_entries=int(os.getenv("SEMANTIC_INDEX_MAX", "10000")),
+        path=os.getenv("SEMANTIC_INDEX_PATH") or None,
+    )
@@ -0,0 +1,214 @@
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from transcript import AI, SYSTEM, USER, Transcript
+
+# Sessions are kept behind a small async interface so the handlers do not care
+# whether they live in this process (bounded LRU + TTL) or in a store shared by
+# every uvicorn worker (SQLite file or Redis).
+#
+# Shared stores hold the session as JSON. The chat history is encoded as
+# [role, content] pairs and the multi-kilobyte system prompts are written by
+# name, so a stored session is little more than the user's own answers:
+#   ["s", "stage1"]  system prompt known by name (see prompts.SYSTEM_PROMPTS)
+#   ["S", "..."]     any other system text
+#   ["h", "..."]     user (HumanMessage)
+#   ["a", "..."]     model (AIMessage)
+
+def dump_history(history: Transcript, system_prompts: Dict[str, str]) -> List[List[str]]:
+    names = {text: name for name, text in system_prompts.items()}
+    rows = []
+    for role, text in history.entries():
+        if role == SYSTEM:
+            name = names.get(text)
+            rows.append(["s", name] if name else ["S", text])
+        elif role == USER:
+            rows.append(["h", text])
+        elif role == AI:
+            rows.append(["a", text])
+    return rows
+
+def load_history(rows: List[List[str]], system_prompts: Dict[str, str]) -> Transcript:
+    history = Transcript()
+    for role, content in rows:
+        if role == "s":
+            history.add_system(system_prompts[content])
+        elif role == "S":
+            history.add_system(content)
+        elif role == "h":
+            history.add_user(content)
+        elif role == "a":
+            history.add_ai(content)
+    return history
+
+def dumps_session(session: Dict[str, Any], system_prompts: Dict[str, str]) -> str:
+    data = dict(session)
+    data["chat_history"] = dump_history(session["chat_history"], system_prompts)
+    return json.dumps(data, separators=(",", ":"))
+
+def loads_session(raw: str, system_prompts: Dict[str, str]) -> Dict[str, Any]:
+    data = json.loads(raw)
+    data.pop("messages_sent_to_frontend", None) # written by older versions
+    data["chat_history"] = load_history(data["chat_history"], system_prompts)
+    return data
+
+
+class SessionStore:
+    # get() returns None for unknown or expired sessions. Callers must put() the
+    # session back after changing it; shared stores hand out copies.
+    async def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def put(self, session_id: str, session: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    async def delete(self, session_id: str) -> None:
+        raise NotImplementedError
+
+    async def size(self) -> int:
+        raise NotImplementedError
+
+    def transcript_bytes(self) -> Optional[List[int]]:
+        # Transcript.nbytes() of every session held in this process; None for
+        # stores that keep sessions elsewhere
+        return None
+
+
+class MemorySessionStore(SessionStore):
+    # Per-process store. Entries are ordered by last access, so both the LRU
+    # victim and the expired entries sit at the front of the dict.
+    def __init__(self, max_sessions: int = 10000, ttl_seconds: float = 3600):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._sessions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._touched: Dict[str, float] = {}
+
+    def _evict(self) -> None:
+        deadline = time.monotonic() - self.ttl_seconds
+        while self._sessions:
+            oldest = next(iter(self._sessions))
+            if len(self._sessions) <= self.max_sessions and self._touched[oldest] > deadline:
+                break
+            del self._sessions[oldest]
+            del self._touched[oldest]
+
+    async def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        self._evict()
+        session = self._sessions.get(session_id)
+        if session is not None:
+            self._sessions.move_to_end(session_id)
+            self._touched[session_id] = time.monotonic()
+        return session
+
+    async def put(self, session_id: str, session: Dict[str, Any]) -> None:
+        self._sessions[session_id] = session
+        self._sessions.move_to_end(session_id)
+        self._touched[session_id] = time.monotonic()
+        self._evict()
+
+    async def delete(self, session_id: str) -> None:
+        self._sessions.pop(session_id, None)
+        self._touched.pop(session_id, None)
+
+    async def size(self) -> int:
+        self._evict()
+        return len(self._sessions)
+
+    def transcript_bytes(self) -> Optional[List[int]]:
+        return [session["chat_history"].nbytes() for session in self._sessions.values()]
+
+
+class SQLiteSessionStore(SessionStore):
+    # A single SQLite file (WAL mode) shared by all workers on the host. Calls run
+    # in a thread so the event loop never waits on disk.
+    PURGE_EVERY = 500 # puts between sweeps of expired rows
+
+    def __init__(self, path: str, system_prompts: Dict[str, str], ttl_seconds: float = 3600):
+        self.system_prompts = system_prompts
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._puts = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, data TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at)")
+
+    def _execute(self, sql: str, params: tuple = ()) -> List[tuple]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    async def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        rows = await asyncio.to_thread(
+            self._execute, "SELECT data FROM sessions WHERE id = ? AND expires_at > ?", (session_id, time.time())
+        )
+        return loads_session(rows[0][0], self.system_prompts) if rows else None
+
+    async def put(self, session_id: str, session: Dict[str, Any]) -> None:
+        data = dumps_session(session, self.system_prompts)
+        await asyncio.to_thread(
+            self._execute,
+            "INSERT INTO sessions (id, data, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at",
+            (session_id, data, time.time() + self.ttl_seconds)
+        )
+        self._puts += 1
+        if self._puts % self.PURGE_EVERY == 0:
+            await asyncio.to_thread(self._execute, "DELETE FROM sessions WHERE expires_at <= ?", (time.time(),))
+
+    async def delete(self, session_id: str) -> None:
+        await asyncio.to_thread(self._execute, "DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    async def size(self) -> int:
+        rows = await asyncio.to_thread(self._execute, "SELECT COUNT(*) FROM sessions WHERE expires_at > ?", (time.time(),))
+        return rows[0][0]
+
+
+class RedisSessionStore(SessionStore):
+    # Shared across hosts; expiry is left to Redis (SET ... EX)
+    def __init__(self, url: str, system_prompts: Dict[str, str], ttl_seconds: float = 3600, prefix: str = "prompt_engine:session:"):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError("SESSION_STORE=redis requires the 'redis' package (pip install redis)") from e
+        self.system_prompts = system_prompts
+        self.ttl_seconds = int(ttl_seconds)
+        self.prefix = prefix
+        self._redis = redis.from_url(url)
+
+    async def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        raw = await self._redis.get(self.prefix + session_id)
+        return loads_session(raw, self.system_prompts) if raw is not None else None
+
+    async def put(self, session_id: str, session: Dict[str, Any]) -> None:
+        await self._redis.set(self.prefix + session_id, dumps_session(session, self.system_prompts), ex=self.ttl_seconds)
+
+    async def delete(self, session_id: str) -> None:
+        await self._redis.delete(self.prefix + session_id)
+
+    async def size(self) -> int:
+        count = 0
+        async for _ in self._redis.scan_iter(match=self.prefix + "*", count=1000):
+            count += 1
+        return count
+
+
+def create_session_store(system_prompts: Dict[str, str]) -> SessionStore:
+    # SESSION_STORE=memory (default) | sqlite | redis
+    kind = os.getenv("SESSION_STORE", "memory").lower()
+    ttl_seconds = float(os.getenv("SESSION_TTL_SECONDS", "3600"))
+    if kind == "sqlite":
+        return SQLiteSessionStore(os.getenv("SESSION_DB_PATH", "sessions.db"), system_prompts, ttl_seconds)
+    if kind == "redis":
+        return RedisSessionStore(os.getenv("REDIS_URL", "redis://localhost:6379/0"), system_prompts, ttl_seconds)
+    if kind != "memory":
+        raise ValueError(f"Unknown SESSION_STORE: {kind}")
+    return MemorySessionStore(int(os.getenv("SESSION_MAX", "10000")), ttl_seconds)
@@ -0,0 +1,124 @@
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+import asyncio
+import logging
+import os
+import time
+
+# Background speculation while the user is typing. Work is keyed by session and
+# tagged with the state it was computed from (e.g. how many answers the draft
+# covers); starting newer work for a key cancels the stale task, and take()
+# waits for work whose tag matches and discards the rest.
+#
+# State is per process: when the next turn lands on another worker the
+# speculation is simply not used and the normal path runs. Results nobody takes
+# (an abandoned or expired session) are dropped once they are older than
+# `max_age` (the session TTL by default), and at most `max_entries` keys are
+# kept, oldest out first.
+
+logger = logging.getLogger("prompt_engine.speculation")
+
+
+class Speculator:
+    def __init__(self, max_age: float = float(os.getenv("SESSION_TTL_SECONDS", "3600")),
+                 max_entries: int = int(os.getenv("SPECULATION_MAX_ENTRIES", "10000"))):
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self._tasks: Dict[str, Tuple[Any, asyncio.Task, float]] = {} # key -> (tag, task, started), oldest first
+        self.started = 0
+        self.used = 0
+        self.discarded = 0
+
+    def schedule(self, key: str, tag: Any, make: Callable[[], Awaitable[Any]]) -> None:
+        current = self._tasks.get(key)
+        if current is not None:
+            if current[0] == tag:
+                return # already speculating on this state
+            self._cancel(current[1])
+        self._start(key, tag, make)
+
+    def extend(self, key: str, tag: Any, make: Callable[[Optional[Any]], Awaitable[Any]]) -> None:
+        # Like schedule, but newer work builds on the current one instead of
+        # cancelling it: `make` gets the previous result (None when there is
+        # none or it failed) once it is ready. Cancelling the new work cancels
+        # the work it is waiting for.
+        current = self._tasks.get(key)
+        if current is not None and current[0] == tag:
+            return
+        previous = current[1] if current is not None else None
+
+        async def follow() -> Any:
+            result = None
+            if previous is not None:
+                try:
+                    await asyncio.wait({previous})
+                except BaseException:
+                    self._cancel(previous)
+                    raise
+                if not previous.cancelled():
+                    result = previous.result()
+            return await make(result)
+
+        self._start(key, tag, follow)
+
+    def _start(self, key: str, tag: Any, make: Callable[[], Awaitable[Any]]) -> None:
+        self.started += 1
+        self._tasks.pop(key, None) # re-inserted as the newest
+        self._tasks[key] = (tag, asyncio.create_task(self._run(key, make)), time.monotonic())
+        self._evict()
+
+    def _evict(self) -> None:
+        deadline = time.monotonic() - self.max_age
+        while self._tasks:
+            key = next(iter(self._tasks))
+            _, task, started = self._tasks[key]
+            if len(self._tasks) <= self.max_entries and (started > deadline or not task.done()):
+                break
+            del self._tasks[key]
+            self._cancel(task)
+
+    async def _run(self, key: str, make: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            return await make()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.info("speculation %s failed: %s", key, e)
+            return None
+
+    def refresh(self, key: str, make: Callable[[], Awaitable[Any]]) -> None:
+        # Fire-and-forget work (e.g. cache warming): started again once the
+        # previous run for `key` has finished, never cancelled
+        current = self._tasks.get(key)
+        if current is not None and not current[1].done():
+            return
+        self._start(key, None, make)
+
+    async def take(self, key: str, tag: Any, timeout: float) -> Optional[Any]:
+        # The result for `key` if it was computed from `tag`, waiting up to
+        # `timeout` seconds when it is still running; anything else (stale,
+        # failed, not done in time) is cancelled and dropped
+        current = self._tasks.pop(key, None)
+        if current is None:
+            return None
+        current_tag, task, _ = current
+        if current_tag == tag:
+            try:
+                await asyncio.wait({task}, timeout=timeout)
+            except BaseException:
+                self._cancel(task) # the caller went away while waiting
+                raise
+            if task.done() and not task.cancelled() and task.result() is not None:
+                self.used += 1
+                return task.result()
+        self._cancel(task)
+        return None
+
+    def discard(self, key: str) -> None:
+        current = self._tasks.pop(key, None)
+        if current is not None:
+            self._cancel(current[1])
+
+    def _cancel(self, task: asyncio.Task) -> None:
+        self.discarded += 1
+        if not task.done():
+            task.cancel()
@@ -0,0 +1,205 @@
+from contextlib import asynccontextmanager, nullcontext
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+import os
+import time
+
+# Timing spans around every model call, exported as Prometheus text on /metrics
+# and, when OTEL_TRACES=1 and opentelemetry is installed, as OpenTelemetry spans
+# carrying the session id. No client library is needed for the Prometheus side.
+
+logger = logging.getLogger("prompt_engine.telemetry")
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError: # optional dependency
+    otel_trace = None
+
+tracer = otel_trace.get_tracer("prompt_engine") if otel_trace and os.getenv("OTEL_TRACES", "0") == "1" else None
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[Any, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.values: Dict[Tuple[Any, ...], float] = {}
+        REGISTRY.append(self)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in sorted(self.values.items(), key=lambda item: tuple(map(str, item[0]))):
+            lines.append(f"{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, labels: Tuple[Any, ...] = (), amount: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, labels: Tuple[Any, ...], value: float) -> None:
+        self.values[labels] = value
+
+    def inc(self, labels: Tuple[Any, ...] = (), amount: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, labels: Tuple[Any, ...] = (), amount: float = 1) -> None:
+        self.inc(labels, -amount)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+    DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60, 120)
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = buckets
+        self.observations: Dict[Tuple[Any, ...], List[float]] = {} # per label set: bucket counts..., sum, count
+
+    def observe(self, labels: Tuple[Any, ...], value: float) -> None:
+        row = self.observations.setdefault(labels, [0.0] * (len(self.buckets) + 2))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                row[i] += 1
+        row[-2] += value
+        row[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, row in sorted(self.observations.items(), key=lambda item: tuple(map(str, item[0]))):
+            for bound, count in zip(self.buckets, row):
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, labels, le)} {_format_value(count)}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, labels, le)} {_format_value(row[-1])}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, labels)} {_format_value(row[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, labels)} {_format_value(row[-1])}")
+        return lines
+
+
+REGISTRY: List[Metric] = []
+
+SPAN_LABELS = ("stage", "backend", "model")
+
+MODEL_CALL_SECONDS = Histogram("prompt_engine_model_call_seconds", "Model call duration, excluding queue wait.", SPAN_LABELS)
+MODEL_QUEUE_SECONDS = Histogram("prompt_engine_model_queue_seconds", "Time spent waiting for a backend slot.", SPAN_LABELS)
+MODEL_CALLS = Counter("prompt_engine_model_calls_total", "Model calls by outcome (ok or the error class).", SPAN_LABELS + ("outcome",))
+MODEL_INPUT_TOKENS = Counter("prompt_engine_model_input_tokens_total", "Input tokens sent to the models.", SPAN_LABELS)
+MODEL_CACHED_INPUT_TOKENS = Counter("prompt_engine_model_cached_input_tokens_total", "Input tokens served from a prefix/context cache instead of prefilled.", SPAN_LABELS)
+MODEL_PREFIX_CACHE = Counter("prompt_engine_model_prefix_cache_total", "Prefix cache lookups reported by the backends, by result.", SPAN_LABELS + ("result",))
+MODEL_OUTPUT_TOKENS = Counter("prompt_engine_model_output_tokens_total", "Output tokens received from the models.", SPAN_LABELS)
+MODEL_RETRIES = Counter("prompt_engine_model_retries_total", "Retries and fallbacks made for model calls.", SPAN_LABELS)
+MODEL_IN_FLIGHT = Gauge("prompt_engine_model_calls_in_flight", "Model calls currently running or queued.", ("backend",))
+LIVE_SESSIONS = Gauge("prompt_engine_live_sessions", "Sessions currently in the session store.")
+LLM_CACHE_LOOKUPS = Gauge("prompt_engine_llm_cache_lookups", "Response cache lookups since start.", ("result",))
+ADMISSION_QUEUE_DEPTH = Gauge("prompt_engine_admission_queue_depth", "Model calls waiting for a backend slot, by priority class.", ("backend", "priority"))
+ADMISSION_SHED = Gauge("prompt_engine_admission_shed", "Model calls shed by admission control since start.", ("backend", "priority", "reason"))
+SEMANTIC_LOOKUPS = Gauge("prompt_engine_semantic_lookups", "Near-duplicate prompt lookups at finalize since start, by outcome.", ("outcome",))
+SESSION_TRANSCRIPT_BYTES = Gauge("prompt_engine_session_transcript_bytes", "Transcript memory held by the in-process sessions: total, per session on average and the largest.", ("stat",))
+SPECULATIONS = Gauge("prompt_engine_speculations", "Speculative model calls since start, by outcome.", ("outcome",))
+
+
+class ModelSpan:
+    __slots__ = ("stage", "backend", "model", "session_id", "input_tokens", "cached_input_tokens", "output_tokens",
+                 "retries", "error", "started", "call_started", "ended")
+
+    def __init__(self, stage: str, backend: str, model: str, session_id: Optional[str], input_tokens: int):
+        self.stage = stage
+        self.backend = backend
+        self.model = model
+        self.session_id = session_id
+        self.input_tokens = input_tokens
+        self.cached_input_tokens: Optional[int] = None # None: the backend does not report it
+        self.output_tokens = 0
+        self.retries = 0
+        self.error: Optional[str] = None
+        self.started = time.perf_counter()
+        self.call_started: Optional[float] = None
+        self.ended: Optional[float] = None
+
+    def acquired(self) -> None:
+        # The backend slot was granted; the model call starts now
+        self.call_started = time.perf_counter()
+
+    def finish(self, text: str, usage: Optional[Dict[str, Any]] = None) -> None:
+        usage = usage or {}
+        self.input_tokens = usage.get("input_tokens") or self.input_tokens
+        self.output_tokens = usage.get("output_tokens") or len(text) // 4
+        details = usage.get("input_token_details") or {}
+        if "cache_read" in details:
+            self.cached_input_tokens = details["cache_read"] or 0
+
+    def attributes(self) -> Dict[str, Any]:
+        call_started = self.call_started or self.started
+        return {
+            "stage": self.stage,
+            "backend": self.backend,
+            "model": self.model,
+            "session_id": self.session_id or "",
+            "input_tokens": self.input_tokens,
+            "cached_input_tokens": self.cached_input_tokens or 0,
+            "output_tokens": self.output_tokens,
+            "retries": self.retries,
+            "error": self.error or "",
+            "queue_seconds": round(call_started - self.started, 4),
+            "call_seconds": round((self.ended or time.perf_counter()) - call_started, 4),
+        }
+
+
+@asynccontextmanager
+async def model_span(stage: str, backend: str, model: str, session_id: Optional[str], input_tokens: int):
+    # `backend` is the expected provider and `model` may be left blank; the
+    # router sets both to what served the call, and the metrics use the final
+    # values
+    span = ModelSpan(stage, backend, model, session_id, input_tokens)
+    MODEL_IN_FLIGHT.inc((backend,))
+    otel_context = tracer.start_as_current_span(f"model_call {stage}") if tracer else nullcontext()
+    with otel_context as otel_span:
+        try:
+            yield span
+        except BaseException as e:
+            span.error = type(e).__name__
+            if otel_span is not None:
+                otel_span.record_exception(e)
+            raise
+        finally:
+            span.ended = time.perf_counter()
+            MODEL_IN_FLIGHT.dec((backend,))
+            labels = (span.stage, span.backend, span.model)
+            attributes = span.attributes()
+            MODEL_QUEUE_SECONDS.observe(labels, attributes["queue_seconds"])
+            MODEL_CALL_SECONDS.observe(labels, attributes["call_seconds"])
+            MODEL_CALLS.inc(labels + (span.error or "ok",))
+            MODEL_INPUT_TOKENS.inc(labels, span.input_tokens)
+            MODEL_OUTPUT_TOKENS.inc(labels, span.output_tokens)
+            if span.cached_input_tokens is not None:
+                MODEL_CACHED_INPUT_TOKENS.inc(labels, span.cached_input_tokens)
+                MODEL_PREFIX_CACHE.inc(labels + ("hit" if span.cached_input_tokens else "miss",))
+            if span.retries:
+                MODEL_RETRIES.inc(labels, span.retries)
+            if otel_span is not None:
+                otel_span.set_attributes({f"prompt_engine.{key}": value for key, value in attributes.items()})
+            logger.info("model_span %s", " ".join(f"{key}={value}" for key, value in attributes.items()))
+
+def render_metrics() -> str:
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
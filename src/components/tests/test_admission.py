@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionGate, Overloaded
+
+
+async def hold(gate: AdmissionGate) -> None:
+    # Take the only slot so later calls queue
+    await gate.acquire("turn")
+
+
+def test_waiters_are_admitted_by_priority_then_arrival():
+    async def scenario():
+        gate = AdmissionGate("test", 1)
+        await hold(gate)
+        order = []
+
+        async def call(priority, name):
+            await gate.acquire(priority)
+            order.append(name)
+            gate.release(0.01)
+
+        tasks = [
+            asyncio.create_task(call("batch", "batch")),
+            asyncio.create_task(call("turn", "turn-1")),
+            asyncio.create_task(call("finalize", "finalize")),
+            asyncio.create_task(call("turn", "turn-2")),
+        ]
+        await asyncio.sleep(0)
+        assert gate.depth()["turn"] == 2
+        gate.release(0.01)
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(scenario()) == ["finalize", "turn-1", "turn-2", "batch"]
+
+
+def test_full_queue_displaces_a_lower_priority_waiter():
+    async def scenario():
+        gate = AdmissionGate("test", 1, max_queue=1)
+        await hold(gate)
+        speculative = asyncio.create_task(gate.acquire("speculative"))
+        await asyncio.sleep(0)
+        finalize = asyncio.create_task(gate.acquire("finalize"))
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded) as shed:
+            await speculative
+        gate.release(0.01)
+        await finalize
+        return shed.value, gate
+
+    error, gate = asyncio.run(scenario())
+    assert error.reason == "displaced"
+    assert error.priority == "speculative"
+    assert error.retry_after >= 1
+    assert gate.shed == {("speculative", "displaced"): 1}
+    assert gate.in_flight == 1
+
+
+def test_full_queue_rejects_a_newcomer_that_does_not_outrank():
+    async def scenario():
+        gate = AdmissionGate("test", 1, max_queue=1)
+        await hold(gate)
+        queued = asyncio.create_task(gate.acquire("finalize"))
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded) as shed:
+            await gate.acquire("turn")
+        queued.cancel()
+        return shed.value
+
+    assert asyncio.run(scenario()).reason == "queue_full"
+
+
+def test_waiter_is_shed_past_its_deadline_and_frees_nothing():
+    async def scenario():
+        gate = AdmissionGate("test", 1, deadlines={"turn": 0.05})
+        await hold(gate)
+        with pytest.raises(Overloaded) as shed:
+            await gate.acquire("turn")
+        gate.release(0.01)
+        return shed.value, gate
+
+    error, gate = asyncio.run(scenario())
+    assert error.reason == "deadline"
+    assert gate.in_flight == 0
+    assert gate.depth()["turn"] == 0
+
+
+def test_cancelled_waiter_does_not_keep_a_slot():
+    async def scenario():
+        gate = AdmissionGate("test", 1)
+        await hold(gate)
+        waiter = asyncio.create_task(gate.acquire("turn"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.sleep(0)
+        gate.release(0.01)
+        await asyncio.wait_for(gate.acquire("batch"), 1)
+        return gate
+
+    assert asyncio.run(scenario()).in_flight == 1
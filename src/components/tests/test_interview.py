@@ -0,0 +1,34 @@
+from interview import INTERVIEW, InterviewEngine
+
+
+def answer(engine: InterviewEngine, key: str, text: str):
+    # Answer the question `key` from a state where everything before it is answered
+    state = engine.new_state()
+    for number, stage in enumerate(engine.stages, start=1):
+        for count, question in enumerate(stage["questions"]):
+            if question["key"] == key:
+                state.update(stage=number, question_count=count)
+                step = engine.answer(state, text)
+                return step, state
+            state["answers"][question["key"]] = "answered"
+    raise KeyError(key)
+
+
+def test_purpose_may_ask_for_writing():
+    engine = InterviewEngine(INTERVIEW)
+    for text in [
+        "Write me product descriptions for our catalogue",
+        "Please write marketing emails for new customers",
+        "Can you write SEO blog posts for my store",
+    ]:
+        step, state = answer(engine, "purpose", text)
+        assert step.kind == "ask"
+        assert state["answers"]["purpose"] == text
+
+
+def test_business_answers_are_still_screened():
+    engine = InterviewEngine(INTERVIEW)
+    step, state = answer(engine, "industry", "Can you write me a Python script to scrape prices?")
+    assert step.kind == "model"
+    assert "unrelated to prompt engineering" in step.hint
+    assert "industry" not in state["answers"]
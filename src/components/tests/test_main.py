@@ -0,0 +1,131 @@
+import asyncio
+import os
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("langchain_core")
+
+# Offline and in memory; main reads these at import time
+os.environ.update({
+    "MODEL1_BACKEND": "fake",
+    "MODEL2_BACKEND": "fake",
+    "LLM3_BACKEND": "fake",
+    "FAKE_TOKEN_LATENCY": "0",
+    "INTERVIEW_MODE": "scripted",
+    "SPECULATION": "0",
+    "LLM_CACHE": "off",
+    "PROMPT_STORE": "0",
+    "SEMANTIC_INDEX": "0",
+    "SESSION_STORE": "memory",
+})
+
+import main  # noqa: E402
+
+ANSWERS = [
+    "Retail",
+    "Corner Books",
+    "New and second-hand books, plus a weekly reading club",
+    "Local readers of all ages",
+    "Write me product descriptions for our catalogue",
+    "Customers find books faster and buy more",
+    "Yes, every week for new arrivals",
+    "Short product descriptions",
+    "Plain text, one paragraph per book",
+    "User: a new thriller arrived. Assistant: a two-line description",
+    "No, a single step is enough",
+]
+
+
+async def interview(stream: bool):
+    turns = []
+    session_id = None
+    for text in [""] + ANSWERS:
+        events = [event async for event in main.run_turn(session_id, text, stream=stream)]
+        session_id = events[0]["session_id"]
+        turns.append(events)
+    return turns
+
+
+def test_streamed_interview_runs_through_finalize():
+    turns = asyncio.run(interview(stream=True))
+
+    final = turns[-1]
+    done = final[-1]
+    assert done["event"] == "done"
+    assert done["status"] == "completed" and done["is_final_prompt"]
+    tokens = "".join(event["text"] for event in final if event["event"] == "token")
+    assert tokens and tokens in done["prompt"]
+    assert all(turn[-1]["event"] == "done" for turn in turns)
+
+
+def test_final_answer_uses_the_speculative_draft(monkeypatch):
+    monkeypatch.setattr(main, "SPECULATION", True)
+    used = main.speculator.used
+
+    turns = asyncio.run(interview(stream=False))
+
+    assert turns[-1][-1]["status"] == "completed"
+    assert main.speculator.used == used + 1
+
+
+def test_draft_is_refined_with_each_answer(monkeypatch):
+    monkeypatch.setattr(main, "SPECULATION", True)
+    monkeypatch.setattr(main, "SPECULATION_DRAFT_REMAINING", 3)
+    started, used = main.speculator.started, main.speculator.used
+
+    turns = asyncio.run(interview(stream=False))
+
+    assert turns[-1][-1]["status"] == "completed"
+    assert main.speculator.started == started + 3 # one draft, then two refinements
+    assert main.speculator.used == used + 1
+
+
+def test_resumed_socket_takes_over_a_running_turn(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    with TestClient(main.app) as client:
+        with client.websocket_connect("/ws") as first:
+            session_id = first.receive_json()["session_id"]
+            while first.receive_json()["event"] != "done":
+                pass
+            for text in ANSWERS[:-1]:
+                first.send_json({"type": "turn", "text": text})
+                while first.receive_json()["event"] != "done":
+                    pass
+            # A slow finalize; the client drops mid-turn and reconnects
+            monkeypatch.setattr(main.get_router("llm3").providers[0].model, "token_latency", 0.01)
+            first.send_json({"type": "turn", "text": ANSWERS[-1]})
+            while first.receive_json()["event"] != "stage":
+                pass
+
+        with client.websocket_connect(f"/ws?session_id={session_id}") as second:
+            assert second.receive_json() == {"event": "session", "session_id": session_id, "resumed": True}
+            events = []
+            while not events or events[-1]["event"] != "done":
+                events.append(second.receive_json())
+
+    done = events[-1]
+    assert done["status"] == "completed" and "replayed" not in done
+    assert [event["event"] for event in events[:2]] == ["banner", "stage"]
+    assert "".join(event["text"] for event in events if event["event"] == "token") in done["prompt"]
+
+
+def test_finalize_candidates_past_the_deadline_ask_for_a_retry(monkeypatch):
+    monkeypatch.setattr(main, "FINALIZE_CANDIDATES", 2)
+    monkeypatch.setattr(main, "FINALIZE_DEADLINE_S", 0.05)
+
+    async def scenario():
+        events = [event async for event in main.run_turn(None, "")]
+        session_id = events[0]["session_id"]
+        for text in ANSWERS[:-1]:
+            await main.collect_turn(main.run_turn(session_id, text))
+        monkeypatch.setattr(main.get_router("llm3").providers[0].model, "token_latency", 0.01)
+        with pytest.raises(main.HTTPException) as error:
+            await main.collect_turn(main.run_turn(session_id, ANSWERS[-1]))
+        return error.value, await main.sessions.get(session_id)
+
+    error, session = asyncio.run(scenario())
+    assert error.status_code == 503
+    assert error.headers["Retry-After"] == str(main.FINALIZE_RETRY_AFTER_S)
+    assert "reasoning" not in session["answers"] # rolled back, the answer can be sent again
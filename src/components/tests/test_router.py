@@ -0,0 +1,136 @@
+import asyncio
+import time
+
+import pytest
+
+from router import CircuitBreaker, ModelRouter, Provider, ProvidersUnavailable
+
+
+class Reply:
+    def __init__(self, content: str):
+        self.content = content
+
+
+class FakeModel:
+    # Stands in for a chat model: answers after `delay` seconds, or fails
+    def __init__(self, name: str, delay: float = 0.0, fail: bool = False):
+        self.model_id = name
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+
+    async def ainvoke(self, messages):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError(f"{self.model_id} failed")
+        return Reply(self.model_id)
+
+
+class FakeSpan:
+    def __init__(self):
+        self.backend = None
+        self.model = None
+        self.retries = 0
+
+    def acquired(self) -> None:
+        pass
+
+
+def provider(model: FakeModel, concurrency: int = 4, latency: float = None) -> Provider:
+    p = Provider(model.model_id, lambda name: model, concurrency, 0, CircuitBreaker(failure_threshold=2, reset_seconds=0.05))
+    if latency is not None:
+        for _ in range(20):
+            p.latency.add(latency)
+    return p
+
+
+def test_breaker_opens_then_lets_one_trial_through():
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=0.05)
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    assert not breaker.allow() # only one trial at a time
+    breaker.record_failure()
+    assert breaker.state == "open" # a failed trial re-opens at once
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow() and breaker.allow()
+
+
+def test_failed_provider_falls_back_to_the_next():
+    primary, backup = FakeModel("primary", fail=True), FakeModel("backup")
+    router = ModelRouter("test", [provider(primary), provider(backup)])
+    span = FakeSpan()
+
+    reply = asyncio.run(router.ainvoke([], span))
+
+    assert reply.content == "backup"
+    assert (span.backend, span.model, span.retries) == ("backup", "backup", 1)
+
+
+def test_backend_that_cannot_be_built_falls_back():
+    def build(name):
+        raise ImportError("no module named torch")
+
+    broken = Provider("local", build, 4, 0, CircuitBreaker(failure_threshold=2, reset_seconds=0.05))
+    backup = FakeModel("backup")
+    router = ModelRouter("test", [broken, provider(backup)])
+    span = FakeSpan()
+
+    reply = asyncio.run(router.ainvoke([], span))
+
+    assert reply.content == "backup"
+    assert (span.backend, span.model) == ("backup", "backup")
+    assert broken.breaker.failures == 1
+
+
+def test_open_circuit_is_skipped_and_reported_when_nothing_is_left():
+    model = FakeModel("only", fail=True)
+    router = ModelRouter("test", [provider(model)])
+
+    for _ in range(2):
+        with pytest.raises(ProvidersUnavailable):
+            asyncio.run(router.ainvoke([]))
+    with pytest.raises(ProvidersUnavailable) as unavailable:
+        asyncio.run(router.ainvoke([]))
+
+    assert model.calls == 2 # the third call never reached the backend
+    assert unavailable.value.retry_after >= 1
+
+
+def test_slow_provider_is_hedged_and_the_backup_labels_the_span():
+    primary, backup = FakeModel("primary", delay=1.0), FakeModel("backup")
+    router = ModelRouter("test", [provider(primary, latency=0.02), provider(backup)])
+    span = FakeSpan()
+
+    started = time.perf_counter()
+    reply = asyncio.run(router.ainvoke([], span))
+
+    assert time.perf_counter() - started < 0.5
+    assert reply.content == "backup"
+    assert (span.backend, span.model, span.retries) == ("backup", "backup", 1)
+
+
+def test_time_spent_queued_does_not_trigger_a_hedge():
+    # Each call takes well under the p95 once it has a slot, but with one slot
+    # the later calls queue for longer than that
+    primary, backup = FakeModel("primary", delay=0.02), FakeModel("backup")
+    router = ModelRouter("test", [provider(primary, concurrency=1, latency=0.06), provider(backup)])
+
+    async def burst():
+        return await asyncio.gather(*(router.ainvoke([]) for _ in range(6)))
+
+    replies = asyncio.run(burst())
+
+    assert [r.content for r in replies] == ["primary"] * 6
+    assert backup.calls == 0
@@ -0,0 +1,72 @@
+import asyncio
+
+from speculation import Speculator
+
+
+async def draft(seconds: float, text: str) -> str:
+    await asyncio.sleep(seconds)
+    return text
+
+
+def test_running_draft_with_the_right_tag_is_awaited():
+    async def scenario():
+        speculator = Speculator()
+        speculator.schedule("draft:s", 3, lambda: draft(0.05, "draft"))
+        return await speculator.take("draft:s", 3, timeout=1), speculator
+
+    result, speculator = asyncio.run(scenario())
+    assert result == "draft"
+    assert (speculator.used, speculator.discarded) == (1, 0)
+
+
+def test_stale_or_late_draft_is_cancelled():
+    async def scenario():
+        speculator = Speculator()
+        speculator.schedule("draft:stale", 2, lambda: draft(0.05, "stale"))
+        speculator.schedule("draft:late", 3, lambda: draft(1, "late"))
+        stale = await speculator.take("draft:stale", 3, timeout=1)
+        late = await speculator.take("draft:late", 3, timeout=0.05)
+        return stale, late, speculator
+
+    stale, late, speculator = asyncio.run(scenario())
+    assert stale is None and late is None
+    assert (speculator.used, speculator.discarded) == (0, 2)
+
+
+def test_extend_builds_on_the_previous_result():
+    async def scenario():
+        speculator = Speculator()
+
+        async def fold(previous, text):
+            await asyncio.sleep(0.01)
+            return f"{previous}+{text}" if previous else text
+
+        speculator.extend("draft:s", 1, lambda previous: fold(previous, "a"))
+        speculator.extend("draft:s", 2, lambda previous: fold(previous, "b"))
+        speculator.extend("draft:s", 2, lambda previous: fold(previous, "ignored")) # same state
+        speculator.extend("draft:s", 3, lambda previous: fold(previous, "c"))
+        return await speculator.take("draft:s", 3, timeout=1)
+
+    assert asyncio.run(scenario()) == "a+b+c"
+
+
+def test_discarding_extended_work_cancels_what_it_waits_for():
+    async def scenario():
+        speculator = Speculator()
+        first = []
+
+        async def slow(previous):
+            first.append(asyncio.current_task())
+            await asyncio.sleep(1)
+
+        async def fold(previous):
+            return previous
+
+        speculator.extend("draft:s", 1, slow)
+        speculator.extend("draft:s", 2, fold)
+        await asyncio.sleep(0.01)
+        speculator.discard("draft:s")
+        await asyncio.sleep(0.01)
+        return first[0]
+
+    assert asyncio.run(scenario()).cancelled()
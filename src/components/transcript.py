@@ -0,0 +1,80 @@
+from array import array
+from typing import Any, Iterator, List, Optional, Tuple
+import os
+import sys
+
+from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
+
+# Compact transcript of an interview session. Sessions used to hold a list of
+# LangChain message objects, each a pydantic model with its own dicts; with
+# thousands of live interviews that overhead dominated the per-session memory.
+# A Transcript keeps one byte of role code per entry in an array and the texts
+# in a plain list. System prompts are interned, so every session points at the
+# same multi-kilobyte string instead of holding a copy. LangChain messages are
+# only built when a model call needs them (to_messages).
+#
+# User and model text is capped per message (TRANSCRIPT_MAX_MESSAGE_CHARS) and
+# per session (TRANSCRIPT_MAX_CHARS). The API refuses user input over either cap
+# before it is recorded anywhere (see fits), so the answers and the transcript
+# always hold the same text; model text past the cap is clipped.
+
+SYSTEM, USER, AI = 0, 1, 2
+MESSAGE_TYPES = {SYSTEM: SystemMessage, USER: HumanMessage, AI: AIMessage}
+
+MAX_MESSAGE_CHARS = int(os.getenv("TRANSCRIPT_MAX_MESSAGE_CHARS", "8000"))
+MAX_CHARS = int(os.getenv("TRANSCRIPT_MAX_CHARS", "64000"))
+
+
+class Transcript:
+    __slots__ = ("roles", "texts", "chars")
+
+    def __init__(self):
+        self.roles = array("B")
+        self.texts: List[str] = []
+        self.chars = 0 # user and model text held; system prompts are shared
+
+    def __len__(self) -> int:
+        return len(self.roles)
+
+    def append(self, role: int, text: str) -> None:
+        if role == SYSTEM:
+            text = sys.intern(text)
+        else:
+            text = text[:max(min(MAX_MESSAGE_CHARS, MAX_CHARS - self.chars), 0)]
+            self.chars += len(text)
+        self.roles.append(role)
+        self.texts.append(text)
+
+    def fits(self, text: str) -> bool:
+        # Whether `text` can be added without clipping
+        return len(text) <= MAX_MESSAGE_CHARS and self.chars + len(text) <= MAX_CHARS
+
+    def add_system(self, text: str) -> None:
+        self.append(SYSTEM, text)
+
+    def add_user(self, text: str) -> None:
+        self.append(USER, text)
+
+    def add_ai(self, text: str) -> None:
+        self.append(AI, text)
+
+    def truncate(self, length: int) -> None:
+        # Drop every entry from `length` on (a failed turn is rolled back)
+        for role, text in self.entries(length):
+            if role != SYSTEM:
+                self.chars -= len(text)
+        del self.roles[length:]
+        del self.texts[length:]
+
+    def entries(self, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+        # (role, text) pairs; start/end index like a list slice
+        return zip(self.roles[start:end], self.texts[start:end])
+
+    def to_messages(self, start: int = 0, end: Optional[int] = None) -> List[Any]:
+        return [MESSAGE_TYPES[role](content=text) for role, text in self.entries(start, end)]
+
+    def nbytes(self) -> int:
+        # Memory held by this session's transcript, not counting shared
+        # (interned) system prompts
+        size = sys.getsizeof(self) + sys.getsizeof(self.roles) + sys.getsizeof(self.texts)
+        return size + sum(sys.getsizeof(text) for role, text in self.entries() if role != SYSTEM)